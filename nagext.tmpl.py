@@ -20,10 +20,42 @@
 This module provides python interface to Nagios external commands
 """
 
+import errno
 import os
+import select
 import stat
+import struct
+import threading
+import weakref
 
-from time import time
+from array import array
+from contextlib import contextmanager
+from time import time, sleep
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = None
+
+# writes of at most PIPE_BUF bytes to a pipe are atomic
+PIPE_BUF = getattr(select, 'PIPE_BUF', 4096)
+
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+F_GETPIPE_SZ = getattr(fcntl, 'F_GETPIPE_SZ', 1032)
+
+PIPE_MAX_SIZE_FILE = '/proc/sys/fs/pipe-max-size'
+
+def pipe_max_size():
+    """
+    Return maximum pipe size an unprivileged process may set,
+    or None if unknown
+    """
+    try:
+        with open(PIPE_MAX_SIZE_FILE) as f:
+            return int(f.read())
+    except (IOError, OSError, ValueError):
+        return None
 
 class ExecError(Exception):
     """
@@ -31,60 +63,752 @@ class ExecError(Exception):
     """
     pass
 
+def format_args(args):
+    """
+    Join command arguments with ';', converting bool to int
+    and decoding bytes as UTF-8.
+    """
+    return ';'.join([a if a.__class__ is str else _normalize(a)
+                     for a in args])
+
+def _normalize(a):
+    if isinstance(a, bool):
+        return str(int(a))
+    elif isinstance(a, bytes):
+        return a.decode('utf-8')
+    return str(a)
+
+def line_chunks(data, size):
+    """
+    Split command lines 'data' (bytes) into memoryview chunks of at most
+    'size' bytes on line boundaries, a longer line is a chunk of its own
+    """
+    view = memoryview(data)
+    start = 0
+    while start < len(data):
+        end = start + size
+        if end < len(data):
+            nl = data.rfind(b'\n', start, end)
+            if nl < 0:
+                nl = data.find(b'\n', end)
+            end = nl + 1 if nl >= 0 else len(data)
+        yield view[start:end]
+        start = end
+
+_commands = None
+
+# arguments of generated methods differing from the commands Nagios takes
+_SIGNATURE_FIXES = {
+    # service_description and start_time run together
+    'SCHEDULE_SVC_DOWNTIME': ('host_name', 'service_description',
+                              'start_time', 'end_time', 'fixed',
+                              'trigger_id', 'duration', 'author', 'comment'),
+    'CHANGE_RETRY_HOST_CHECK_INTERVAL': ('host_name', 'check_interval'),
+    'CHANGE_HOST_CHECK_TIMEPERIOD': ('host_name', 'check_timeperiod'),
+}
+
+def commands():
+    """
+    Return dict mapping external command ids of generated NagExt methods
+    to tuples of names of arguments Nagios takes
+    """
+    global _commands
+    if _commands is None:
+        table = {}
+        for name, method in vars(NagExt).items():
+            cmd = name.upper()
+            code = getattr(method, '__code__', None)
+            # generated methods run their own command id
+            if code is None or cmd not in code.co_consts:
+                continue
+            table[cmd] = code.co_varnames[1:code.co_argcount]
+        table.update(_SIGNATURE_FIXES)
+        _commands = table
+    return _commands
+
+# arguments naming objects, interned in queued commands
+NAME_ARGS = frozenset(['host_name', 'service_description', 'hostgroup_name',
+                       'servicegroup_name', 'contact_name',
+                       'contactgroup_name'])
+
+class NameTable(object):
+    """
+    Table of object names as UTF-8 bytes, numbered in order of
+    appearance, holding at most 'max_size' names
+    """
+
+    def __init__(self, max_size=1 << 20):
+        self.max_size = max_size
+        self.ids = {}
+        self.names = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        """
+        Return id of 'name', or None if the table is full
+        """
+        i = self.ids.get(name)
+        if i is None:
+            with self._lock:
+                i = self.ids.get(name)
+                if i is None:
+                    if len(self.names) >= self.max_size:
+                        return None
+                    i = len(self.names)
+                    self.names.append(name.encode('utf-8'))
+                    self.ids[name] = i
+        return i
+
+    def clear(self):
+        with self._lock:
+            self.ids = {}
+            self.names = []
+
+class _Commands(object):
+    """
+    Command ids as small integers: generated commands in sorted order,
+    then other commands as they are run. 'specs' maps command to
+    (id, number of leading name arguments, number of arguments or -1 if
+    unknown), 'names' are commands as bytes by id.
+    """
+
+    def __init__(self):
+        self.specs = {}
+        self.names = []
+        self.layouts = []
+        self._lock = threading.Lock()
+        for cmd, args in sorted(commands().items()):
+            prefix = 0
+            while prefix < len(args) and args[prefix] in NAME_ARGS:
+                prefix += 1
+            self._add(cmd, prefix, len(args))
+
+    def _add(self, cmd, prefix, count):
+        spec = self.specs[cmd] = (len(self.names), prefix, count)
+        self.names.append(cmd.encode('utf-8'))
+        self.layouts.append((prefix, count))
+        return spec
+
+    def spec(self, cmd):
+        with self._lock:
+            spec = self.specs.get(cmd)
+            if spec is None:
+                if len(self.names) >= RAW:
+                    raise ValueError('Too many command ids')
+                spec = self._add(cmd, 0, -1)
+        return spec
+
+_command_table = None
+
+# flag of command ids with all arguments kept as text
+RAW = 0x8000
+
+class CommandQueue(object):
+    """
+    Commands waiting to be written, kept in columns: timestamp, command id,
+    ids of leading object name arguments in NameTable 'table' and remaining
+    arguments as UTF-8 text. Takes a fraction of memory of formatted lines
+    when many commands name the same objects. Without 'table' the queue
+    has its own, emptied with the queue so names of objects gone don't
+    pile up.
+    """
+
+    max_names = 1 << 18
+
+    def __init__(self, table=None):
+        global _command_table
+        if _command_table is None:
+            _command_table = _Commands()
+        self.commands = _command_table
+        self._own_names = table is None
+        self.names = NameTable(self.max_names) if table is None else table
+        self.clear()
+
+    def clear(self):
+        if self._own_names and self.names:
+            self.names.clear()
+        # timestamp << 16 | command id
+        self._heads = array('q')
+        self._name_ids = array('I')
+        self._text = bytearray()
+        self._ends = array('Q')
+
+    def __len__(self):
+        return len(self._heads)
+
+    def append(self, timestamp, cmd, args):
+        """
+        Queue command 'cmd' with arguments 'args' stamped with 'timestamp'
+        """
+        spec = self.commands.specs.get(cmd)
+        if spec is None:
+            spec = self.commands.spec(cmd)
+        i, prefix, count = spec
+        text = ';'.join([a if a.__class__ is str else _normalize(a)
+                         for a in args])
+        if count != len(args):
+            i |= RAW
+        elif prefix:
+            # names with ';' come back the same when joined again
+            parts = text.split(';', prefix)
+            get = self.names.ids.get
+            if prefix == 1:
+                name_ids = (get(parts[0]),)
+            elif prefix == 2:
+                name_ids = (get(parts[0]), get(parts[1]))
+            else:
+                name_ids = tuple(map(get, parts[:prefix]))
+            if None in name_ids:
+                name_ids = tuple(map(self.names.intern, parts[:prefix]))
+            if None in name_ids:
+                # table is full
+                i |= RAW
+            else:
+                self._name_ids.extend(name_ids)
+                # with separator after names
+                text = ';' + parts[prefix] if len(parts) > prefix else ''
+        self._heads.append(int(timestamp) << 16 | i)
+        self._text += (text + '\n').encode('utf-8')
+        self._ends.append(len(self._text))
+
+    def truncate(self, count):
+        """
+        Drop commands queued after the first 'count'
+        """
+        if count >= len(self._heads):
+            return
+        layouts = self.commands.layouts
+        n = 0
+        for h in self._heads[:count]:
+            i = h & 0xffff
+            if not i & RAW:
+                n += layouts[i][0]
+        del self._text[self._ends[count - 1] if count else 0:]
+        del self._heads[count:]
+        del self._ends[count:]
+        del self._name_ids[n:]
+
+    def counts(self):
+        """
+        Return dict mapping command ids to number of them queued
+        """
+        ids = {}
+        for h in self._heads:
+            i = h & 0xffff & ~RAW
+            ids[i] = ids.get(i, 0) + 1
+        names = self.commands.names
+        return dict((names[i].decode('utf-8'), n) for i, n in ids.items())
+
+    def encode(self):
+        """
+        Return queued commands as command file lines (bytes)
+        """
+        cmd_names = self.commands.names
+        layouts = self.commands.layouts
+        names = self.names.names
+        name_ids = self._name_ids
+        text = bytes(self._text)
+        out = []
+        add = out.append
+        n = 0
+        start = 0
+        last = None
+        for h, end in zip(self._heads, self._ends):
+            if h != last:
+                # commands in a batch mostly share time and command
+                last = h
+                i = h & 0xffff
+                head = b'[%d] %s;' % (h >> 16, cmd_names[i & ~RAW])
+                prefix = 0 if i & RAW else layouts[i][0]
+            add(head)
+            if prefix == 1:
+                add(names[name_ids[n]])
+                n += 1
+            elif prefix:
+                add(b';'.join([names[j] for j in name_ids[n:n + prefix]]))
+                n += prefix
+            add(text[start:end])
+            start = end
+        return b''.join(out)
+
+# NagExt objects to detach in forked children
+_instances = weakref.WeakSet()
+
+def _after_fork():
+    for nagext in list(_instances):
+        nagext._detach()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
 class NagExt(object):
     """
     Deal with nagios command file for executing external commands.
     Writes commands to Nagios command_file in following format:
     [time] command_id;command_arguments
 
+    Commands run inside 'with nagext.batch():' are buffered and written
+    when the outermost batch ends, in chunks of at most 'chunk_size'
+    (PIPE_BUF) bytes split on line boundaries so they don't interleave
+    with other writers. If an exception leaves a batch block, commands
+    run inside it are dropped. Batches belong to the thread running
+    them, commands of other threads are not held or dropped with them.
+    Queued commands are kept compactly in a CommandQueue.
+
+    If 'metrics' (see nagext_metrics.Metrics) is given, write path
+    counters and latencies are recorded there.
+
+    Hooks registered with add_hook() are called around every command,
+    including generated methods as they all go through run().
+
+    With 'adaptive' set commands outside of batch() are paced by command
+    file occupancy (Linux only): while the pipe is filled less than
+    'low_watermark' every command is written immediately, above
+    'high_watermark' commands are batched in growing batches up to
+    'max_batch' and the caller is slowed down up to 'max_pace' seconds per
+    batch. Pending commands are written at most 'max_delay' seconds after
+    they were run, by a timer thread if no other command comes; call
+    flush() or close() to write them at once.
+
+    'pipe_size' asks to enlarge command file pipe buffer (Linux only),
+    see open().
+
+    Commands may be sent through 'transport' instead of command file
+    (see nagext_qh), an object with open(), send(data) taking formatted
+    command lines as bytes, close() and detach() dropping its connection
+    in a forked child. Batching, hooks and metrics work the same.
+
+    NagExt objects are fork safe: a forked child drops commands pending
+    in the parent and opens command file again on first write. They can
+    be pickled to pass to multiprocessing workers, an unpickled copy opens
+    command file on first write; metrics and hooks are not pickled.
     """
 
-    def __init__(self, command_file):
-        self.command_file = command_file
-        self._cmd_f = None
+    chunk_size = PIPE_BUF
+    low_watermark = 0.25
+    high_watermark = 0.75
+    max_batch = 1024
+    max_pace = 0.1
+    max_delay = 1.0
+    sample_interval = 0.01
+    sample_every = 32
+
+    def __init__(self, command_file, metrics=None, adaptive=False,
+                 pipe_size=None, transport=None):
+        self._setup(command_file, metrics, adaptive, pipe_size, transport)
         self.open()
 
+    def _setup(self, command_file, metrics, adaptive, pipe_size,
+               transport=None):
+        self.command_file = command_file
+        self.transport = transport
+        self.requested_pipe_size = pipe_size
+        self.pipe_size = None
+        self.metrics = metrics
+        self.adaptive = adaptive
+        self._cmd_fd = None
+        self._pending = CommandQueue()
+        self._pending_since = 0
+        # flushes pending commands after max_delay in adaptive mode
+        self._timer = None
+        self._timer_error = None
+        self._lock = threading.RLock()
+        # queue of batch() of each thread
+        self._local = threading.local()
+        self._batch_target = 1
+        self._sampled = 0
+        self._unsampled = 0
+        self._hooks = ()
+        self._pid = os.getpid()
+        _instances.add(self)
+
+    def __getstate__(self):
+        return {
+            'command_file': self.command_file,
+            'adaptive': self.adaptive,
+            'pipe_size': self.requested_pipe_size,
+            'transport': self.transport,
+        }
+
+    def __setstate__(self, state):
+        self._setup(metrics=None, **state)
+
     def __del__(self):
         self.close()
 
-    def open(self):
+    def _detach(self):
+        """
+        Forget command file descriptor and pending commands inherited
+        from parent process
+        """
+        self._pending.clear()
+        # timer thread and lock holders are left in the parent
+        self._timer = None
+        self._lock = threading.RLock()
+        queue = getattr(self._local, 'queue', None)
+        if queue is not None:
+            # forked inside batch(), commands run so far are parent's
+            queue.clear()
+        if self._cmd_fd is not None:
+            try:
+                os.close(self._cmd_fd)
+            except OSError:
+                pass
+            self._cmd_fd = None
+        if self.transport is not None:
+            self.transport.detach()
+        self._pid = os.getpid()
+
+    def open(self, pipe_size=None, wait=True):
         """Open Nagios command file
 
+        If 'pipe_size' (or 'pipe_size' given to constructor) is set, pipe
+        buffer is resized to it with F_SETPIPE_SZ, limited by
+        /proc/sys/fs/pipe-max-size. Size actually granted is stored in
+        'pipe_size' attribute; if resizing is not permitted current size
+        is kept.
+
+        With 'wait' open waits for Nagios to read command file, otherwise
+        it fails at once. With 'transport' set opens the transport instead.
+
         Raises:
-          ExecError: if the file 'command_file' doesn't exist, can't be open
-          or is not a pipe (fifo)
+          ExecError: if the file 'command_file' doesn't exist, can't be open,
+          is not a pipe (fifo) or, without 'wait', nobody reads it
         """
+        if self.transport is not None:
+            self.transport.open()
+            return
         try:
             st = os.stat(self.command_file)
             if not stat.S_ISFIFO(st.st_mode):
                 raise IOError('The command file "%s" is not a pipe' %
                               self.command_file)
-            self._cmd_f = open(self.command_file, 'w')
+            if self._cmd_fd is not None:
+                os.close(self._cmd_fd)
+                self._cmd_fd = None
+                if self.metrics is not None:
+                    self.metrics.inc('reconnects')
+            if wait:
+                self._cmd_fd = os.open(self.command_file, os.O_WRONLY)
+            else:
+                # fails with ENXIO if no process reads the fifo
+                fd = os.open(self.command_file, os.O_WRONLY | os.O_NONBLOCK)
+                os.set_blocking(fd, True)
+                self._cmd_fd = fd
         except (OSError, IOError) as e:
+            if e.errno == errno.ENXIO:
+                raise ExecError('Nagios doesn\'t read the command file "%s"'
+                                % self.command_file)
             raise ExecError(str(e))
+        if pipe_size is None:
+            pipe_size = self.requested_pipe_size
+        self.pipe_size = self._set_pipe_size(pipe_size)
+
+    def _set_pipe_size(self, size):
+        if fcntl is None:
+            return None
+        try:
+            if size:
+                limit = pipe_max_size()
+                if limit is not None:
+                    size = min(size, limit)
+                current = fcntl.fcntl(self._cmd_fd, F_GETPIPE_SZ)
+                if size > current:
+                    try:
+                        fcntl.fcntl(self._cmd_fd, F_SETPIPE_SZ, size)
+                    except (OSError, IOError) as e:
+                        # EPERM: over the limit for unprivileged users,
+                        # EBUSY: pipe holds more data than new size
+                        if e.errno not in (errno.EPERM, errno.EBUSY):
+                            raise
+            return fcntl.fcntl(self._cmd_fd, F_GETPIPE_SZ)
+        except (OSError, IOError):
+            return None
 
     def close(self):
         """
-        Close Nagios command file
+        Close Nagios command file, writing pending commands
+        """
+        if self._pid != os.getpid():
+            self._detach()
+            return
+        timer = self._timer
+        if timer is not None:
+            timer.cancel()
+        try:
+            self.flush()
+        finally:
+            if self._cmd_fd is not None:
+                os.close(self._cmd_fd)
+                self._cmd_fd = None
+            if self.transport is not None:
+                self.transport.close()
+
+    @contextmanager
+    def batch(self):
         """
-        self._cmd_f.close()
+        Buffer commands run inside 'with' block and write them at once.
+
+        Batches are all or nothing: if an exception leaves the block,
+        commands run inside it are dropped, not written. Commands run by
+        other threads meanwhile are not part of the batch.
+        """
+        local = self._local
+        outermost = getattr(local, 'queue', None) is None
+        if outermost:
+            local.queue = CommandQueue()
+        queue = local.queue
+        mark = len(queue)
+        try:
+            yield self
+        except BaseException:
+            queue.truncate(mark)
+            raise
+        finally:
+            if outermost:
+                local.queue = None
+        if outermost:
+            with self._lock:
+                # commands run before the batch go first
+                self.flush()
+                self._write_queue(queue)
+
+    def pipe_occupancy(self):
+        """
+        Return fraction of command file pipe buffer not yet read by Nagios,
+        or None if it can't be determined on this platform
+        """
+        if fcntl is None or self._cmd_fd is None:
+            return None
+        try:
+            buf = fcntl.ioctl(self._cmd_fd, termios.FIONREAD, b'\0\0\0\0')
+            used = struct.unpack('i', buf)[0]
+            size = self.pipe_size
+            if size is None:
+                size = fcntl.fcntl(self._cmd_fd, F_GETPIPE_SZ)
+        except (OSError, IOError):
+            return None
+        occupancy = float(used) / size
+        if self.metrics is not None:
+            self.metrics.set('pipe_occupancy', occupancy)
+        return occupancy
 
     def run(self, cmd, *args):
         """
         Run Nagios external command with given arguments,
         converting bool to int.
         """
-        def normalize_args(a):
-            if isinstance(a, bool):
-                a = int(a)
-            return str(a)
+        self.run_at(time(), cmd, *args)
+
+    def add_hook(self, pre=None, post=None):
+        """
+        Register hooks called around every command.
 
+        pre(cmd, args) is called before the command is written, its return
+        value is passed as 'context' to
+        post(cmd, args, started, elapsed, error, context) called afterwards
+        with start time, seconds spent and exception raised or None.
+        Inside batch() elapsed covers queueing, not the final write.
+        """
+        self._hooks = self._hooks + ((pre, post),)
+
+    def remove_hook(self, pre=None, post=None):
+        """
+        Unregister hooks registered with add_hook()
+        """
+        self._hooks = tuple(h for h in self._hooks if h != (pre, post))
+
+    def run_at(self, timestamp, cmd, *args):
+        """
+        Run Nagios external command with given arguments, stamping it
+        with 'timestamp' instead of current time.
+        """
+        if self._hooks:
+            self._run_hooked(timestamp, cmd, args)
+        else:
+            self._run_at(timestamp, cmd, args)
+
+    def _run_hooked(self, timestamp, cmd, args):
+        hooks = self._hooks
+        contexts = [pre(cmd, args) if pre is not None else None
+                    for pre, post in hooks]
+        error = None
+        started = time()
+        try:
+            self._run_at(timestamp, cmd, args)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time() - started
+            for (pre, post), context in zip(hooks, contexts):
+                if post is not None:
+                    post(cmd, args, started, elapsed, error, context)
+
+    def _run_at(self, timestamp, cmd, args):
+        if self._pid != os.getpid():
+            # forked without at-fork hook, pending commands are parent's
+            self._detach()
+        queue = getattr(self._local, 'queue', None)
+        if queue is not None:
+            self._queue(queue, timestamp, cmd, args)
+            return
+        if not (self.adaptive or self._pending):
+            # written at once, not worth queueing
+            try:
+                data = ("[%lu] %s;%s\n" % (timestamp, cmd, format_args(args))
+                        ).encode('utf-8')
+            except Exception as e:
+                raise ExecError(str(e))
+            if self.metrics is not None:
+                self.metrics.inc('flushes')
+            self.write_data(data)
+            if self.metrics is not None:
+                self.metrics.command(cmd)
+            return
+        if self.adaptive:
+            # timer may flush meanwhile
+            with self._lock:
+                self._queue(self._pending, timestamp, cmd, args)
+                self._pace()
+            return
+        self._queue(self._pending, timestamp, cmd, args)
+        self.flush()
+
+    def _queue(self, queue, timestamp, cmd, args):
+        try:
+            queue.append(timestamp, cmd, args)
+        except Exception as e:
+            raise ExecError(str(e))
+        if self.metrics is not None:
+            self.metrics.set('queue_depth', len(queue))
+
+    def _pace(self):
+        now = time()
+        if len(self._pending) == 1:
+            self._pending_since = now
+        self._unsampled += 1
+        # sample on interval, every 'sample_every' commands and always
+        # under load, when writes are batched anyway
+        if (self._batch_target > 1 or self._unsampled >= self.sample_every or
+                now - self._sampled >= self.sample_interval):
+            self._sampled = now
+            self._unsampled = 0
+            occupancy = self.pipe_occupancy()
+            if occupancy is None or occupancy <= self.low_watermark:
+                self._batch_target = 1
+            elif occupancy >= self.high_watermark:
+                self._batch_target = min(self._batch_target * 2,
+                                         self.max_batch)
+                delay = (self.max_pace * (occupancy - self.high_watermark) /
+                         (1 - self.high_watermark))
+                sleep(min(delay, self.max_pace))
+            if self.metrics is not None:
+                self.metrics.set('batch_target', self._batch_target)
+        if (len(self._pending) >= self._batch_target or
+                now - self._pending_since >= self.max_delay):
+            self.flush()
+        elif self._timer is None:
+            # no more commands may come to write these
+            self._timer = threading.Timer(
+                self.max_delay - (now - self._pending_since), self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _expire(self):
+        with self._lock:
+            self._timer = None
+            if self._pid != os.getpid():
+                return
+            try:
+                self.flush()
+            except ExecError as e:
+                self._timer_error = e
+
+    def flush(self):
+        """
+        Write pending commands to command file
+
+        Raises:
+          ExecError: if writing fails, also if writing by max_delay timer
+          failed since the last call
+        """
+        with self._lock:
+            error = self._timer_error
+            if error is not None:
+                self._timer_error = None
+                raise error
+            self._write_queue(self._pending)
+
+    def _write_queue(self, queue):
+        if not queue:
+            return
+        data = queue.encode()
+        metrics = self.metrics
+        if metrics is not None:
+            counts = queue.counts()
+        queue.clear()
+        if metrics is not None:
+            metrics.inc('flushes')
+            metrics.set('queue_depth', 0)
+        self.write_data(data)
+        if metrics is not None:
+            for cmd, n in counts.items():
+                metrics.command(cmd, n)
+
+    def write_data(self, data):
+        """
+        Write already formatted command lines 'data' (bytes) to command
+        file in chunks of at most 'chunk_size' bytes split on line
+        boundaries
+
+        Raises:
+          ExecError: if writing fails
+        """
+        if self._cmd_fd is None and self.transport is None:
+            # Nagios may be stopped, don't wait for it
+            self.open(wait=False)
+        if self.metrics is not None:
+            self.metrics.inc('bytes', len(data))
+            t0 = time()
         try:
-            str_args = ';'.join([normalize_args(a) for a in args])
-            self._cmd_f.write("[%lu] %s;%s\n" % (time(), cmd, str_args))
-            self._cmd_f.flush()
+            if self.transport is not None:
+                self.transport.send(data)
+            else:
+                self._write_chunks(data)
+        except ExecError:
+            raise
         except Exception as e:
             raise ExecError(str(e))
+        if self.metrics is not None:
+            self.metrics.observe('write_latency', time() - t0)
+
+    def _write_chunks(self, data):
+        for chunk in line_chunks(data, self.chunk_size):
+            self._write(chunk)
+
+    def _write(self, data):
+        view = memoryview(data)
+        reopened = False
+        while view:
+            try:
+                n = os.write(self._cmd_fd, view)
+            except OSError as e:
+                # reader has gone (Nagios restarted), reopen once if it
+                # reads again
+                if e.errno != errno.EPIPE or reopened or len(view) != len(data):
+                    raise
+                self.open(wait=False)
+                reopened = True
+                continue
+            if self.metrics is not None:
+                self.metrics.inc('write_syscalls')
+                if n < len(view):
+                    self.metrics.inc('partial_writes')
+            view = view[n:]
 
     # next follow automatically generated methods from nagios developer documentation
     # for external commands
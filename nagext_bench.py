@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmarks of NagExt write path.
+
+A temporary fifo is drained by a reader process standing in for Nagios,
+optionally limited to given number of lines per second to simulate a slow
+Nagios. Every scenario writes commands with NagExt.run or with generated
+method process_service_check_result and reports commands/sec, bytes/sec
+and per-call latency percentiles as JSON. Commands are written in
+NagExt.batch() blocks of given batch size.
+
+Results of a previous run can be given with --compare to fail when
+throughput drops more than --tolerance.
+
+With --memory memory taken by queued commands is measured instead,
+NagExt queue against the same commands kept as formatted lines.
+"""
+
+import json
+import multiprocessing
+import os
+import select
+import shutil
+import sys
+import tempfile
+import threading
+import tracemalloc
+
+from time import time, sleep
+
+from nagext import NagExt, CommandQueue, NameTable, format_args
+from nagext_replay import percentile
+
+def reader(fifo, rate, stop, result):
+    """
+    Drain 'fifo' counting lines and bytes, reading at most 'rate' lines
+    per second if 'rate' is not 0, until 'stop' is set.
+    Puts (lines, bytes) to 'result' queue while reading and when idle.
+    """
+    # O_RDWR keeps the fifo open when writers come and go
+    fd = os.open(fifo, os.O_RDWR)
+    lines = nbytes = 0
+    start = reported = time()
+    while not stop.is_set():
+        if not select.select([fd], [], [], 0.01)[0]:
+            if reported:
+                result.put((lines, nbytes))
+                reported = 0
+            continue
+        data = os.read(fd, 4096 if rate else 65536)
+        lines += data.count(b'\n')
+        nbytes += len(data)
+        if time() - reported > 0.01:
+            result.put((lines, nbytes))
+            reported = time()
+        if rate:
+            delay = start + float(lines) / rate - time()
+            if delay > 0:
+                sleep(delay)
+    os.close(fd)
+
+class Reader(object):
+    """
+    Reader process standing in for Nagios
+    """
+
+    def __init__(self, fifo, rate=0):
+        self._stop = multiprocessing.Event()
+        self._result = multiprocessing.Queue()
+        self.lines = self.bytes = 0
+        self._proc = multiprocessing.Process(
+            target=reader, args=(fifo, rate, self._stop, self._result))
+        self._proc.daemon = True
+        self._proc.start()
+
+    def wait(self, lines, timeout=60):
+        """
+        Wait until reader received 'lines' lines
+        """
+        deadline = time() + timeout
+        while self.lines < lines and time() < deadline:
+            try:
+                self.lines, self.bytes = self._result.get(timeout=0.1)
+            except Exception:
+                pass
+        return self.lines >= lines
+
+    def stop(self):
+        self._stop.set()
+        self._proc.join()
+
+def writer(nagext, method, count, batch, output, latencies):
+    host = 'host-%d' % threading.current_thread().ident
+    if method == 'run':
+        call = lambda i: nagext.run('PROCESS_SERVICE_CHECK_RESULT',
+                                    host, 'svc-%d' % i, 0, output)
+    else:
+        call = lambda i: nagext.process_service_check_result(
+            host, 'svc-%d' % i, 0, output)
+    for i in range(0, count, batch):
+        t0 = time()
+        with nagext.batch():
+            for j in range(i, min(i + batch, count)):
+                call(j)
+        latencies.append((time() - t0) / (min(i + batch, count) - i))
+
+def bench(fifo, method='run', count=10000, batch=1, arg_size=32, writers=1,
+          rate=0):
+    """
+    Run one scenario, returns dict with results
+    """
+    output = 'OK - ' + 'x' * max(arg_size - 5, 0)
+    reader = Reader(fifo, rate)
+    nagexts = [NagExt(fifo) for i in range(writers)]
+    latencies = [[] for i in range(writers)]
+    threads = [threading.Thread(target=writer,
+                                args=(nagexts[i], method, count, batch,
+                                      output, latencies[i]))
+               for i in range(writers)]
+    start = time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    write_elapsed = time() - start
+    drained = reader.wait(count * writers)
+    elapsed = time() - start
+    reader.stop()
+    for n in nagexts:
+        n.close()
+
+    lat = sorted(l for ls in latencies for l in ls)
+    return {
+        'method': method,
+        'count': count * writers,
+        'batch': batch,
+        'arg_size': arg_size,
+        'writers': writers,
+        'reader_rate': rate,
+        'drained': drained,
+        'write_elapsed': write_elapsed,
+        'elapsed': elapsed,
+        'commands_per_sec': reader.lines / elapsed,
+        'bytes_per_sec': reader.bytes / elapsed,
+        'latency_p50': percentile(lat, 50),
+        'latency_p99': percentile(lat, 99),
+    }
+
+MEMORY_COMMANDS = (
+    ('PROCESS_SERVICE_CHECK_RESULT', lambda h, s: (h, s, 0, 'OK - 42 ms')),
+    ('SCHEDULE_FORCED_SVC_CHECK', lambda h, s: (h, s, 1700000000)),
+    ('ENABLE_SVC_NOTIFICATIONS', lambda h, s: (h, s)),
+    ('DISABLE_HOST_CHECK', lambda h, s: (h,)),
+)
+
+def _allocated(build):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return used
+
+def memory(count=500000, hosts=5000, services=20):
+    """
+    Return dict with bytes taken by 'count' queued commands on 'hosts'
+    hosts with 'services' services each
+    """
+    def commands():
+        for i in range(count):
+            cmd, args = MEMORY_COMMANDS[i % len(MEMORY_COMMANDS)]
+            yield cmd, args('host-%05d.example.com' % (i % hosts),
+                            'Service check %d' % (i // hosts % services))
+
+    def lines():
+        return ['[%lu] %s;%s\n' % (1700000000, cmd, format_args(args))
+                for cmd, args in commands()]
+
+    def queue():
+        # table counted too
+        q = CommandQueue(NameTable())
+        for cmd, args in commands():
+            q.append(1700000000, cmd, args)
+        return q
+
+    lines_bytes = _allocated(lines)
+    queue_bytes = _allocated(queue)
+    return {
+        'count': count,
+        'hosts': hosts,
+        'services': services,
+        'lines_bytes': lines_bytes,
+        'queue_bytes': queue_bytes,
+        'ratio': float(lines_bytes) / queue_bytes,
+    }
+
+def scenarios(count, rate):
+    for method in ('run', 'generated'):
+        for batch in (1, 100):
+            for arg_size in (32, 1024):
+                for writers in (1, 4):
+                    yield dict(method=method, count=count, batch=batch,
+                               arg_size=arg_size, writers=writers, rate=rate)
+
+def key(result):
+    return (result['method'], result['batch'], result['arg_size'],
+            result['writers'], result['reader_rate'])
+
+def compare(results, baseline, tolerance):
+    """
+    Return list of messages about scenarios slower than in 'baseline'
+    """
+    base = dict((key(r), r) for r in baseline)
+    regressions = []
+    for r in results:
+        b = base.get(key(r))
+        if b is None:
+            continue
+        if r['commands_per_sec'] < b['commands_per_sec'] * (1 - tolerance):
+            regressions.append('%s: %.0f commands/sec, baseline %.0f' %
+                               (key(r), r['commands_per_sec'],
+                                b['commands_per_sec']))
+    return regressions
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark NagExt write path')
+    parser.add_argument('-n', '--count', type=int, default=10000,
+                        help='commands per writer')
+    parser.add_argument('-r', '--rate', type=int, default=0,
+                        help='reader speed in lines/sec, 0 is unlimited')
+    parser.add_argument('-o', '--output', help='write JSON results to file')
+    parser.add_argument('-c', '--compare', help='baseline JSON results')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help='allowed relative throughput drop')
+    parser.add_argument('-m', '--memory', action='store_true',
+                        help='measure memory of -n queued commands')
+    opts = parser.parse_args(argv)
+
+    if opts.memory:
+        json.dump(memory(opts.count), sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+        return 0
+
+    tmpdir = tempfile.mkdtemp(prefix='nagext-bench-')
+    fifo = os.path.join(tmpdir, 'nagios.cmd')
+    os.mkfifo(fifo)
+    try:
+        results = [bench(fifo, **s) for s in scenarios(opts.count, opts.rate)]
+    finally:
+        shutil.rmtree(tmpdir)
+
+    out = open(opts.output, 'w') if opts.output else sys.stdout
+    json.dump(results, out, indent=2, sort_keys=True)
+    out.write('\n')
+
+    if opts.compare:
+        with open(opts.compare) as f:
+            regressions = compare(results, json.load(f), opts.tolerance)
+        for r in regressions:
+            sys.stderr.write('regression %s\n' % r)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
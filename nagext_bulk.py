@@ -0,0 +1,152 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Bulk deletion of downtimes and comments selected by filter.
+
+    removed = delete_downtimes(nagext, '/var/cache/nagios3/status.dat',
+                               host='web*', author='deploy')
+
+Matching ids are found in status.dat (a StatusCache may be given instead
+of a path) and all DEL_*_DOWNTIME or DEL_*_COMMENT commands are written
+in one NagExt batch. Removed Downtime or Comment records are returned.
+At least one filter criterion must be given, or all=True to delete
+every downtime or comment.
+"""
+
+import re
+
+from fnmatch import translate
+
+from nagext_status import BLOCKS, Comment, StatusCache, iter_status
+
+_DOWNTIME_BLOCKS = dict((k, v) for k, v in BLOCKS.items()
+                        if k.endswith(b'downtime'))
+_COMMENT_BLOCKS = dict((k, v) for k, v in BLOCKS.items()
+                       if k.endswith(b'comment'))
+
+class Filter(object):
+    """
+    Downtimes or comments of hosts matching glob 'host' (and services
+    matching glob 'service'; '' selects host ones only) written by
+    'author', with comment containing 'comment', active within
+    'start'..'end' (comments by entry time). None matches anything.
+    """
+
+    def __init__(self, host=None, service=None, author=None, comment=None,
+                 start=None, end=None):
+        self.host = None if host is None else re.compile(translate(host))
+        if service is None or service == '':
+            self.service = service
+        else:
+            self.service = re.compile(translate(service))
+        self.author = author
+        self.comment = comment
+        self.start = start
+        self.end = end
+
+    def __call__(self, obj):
+        if self.host is not None and not self.host.match(obj.host_name):
+            return False
+        if self.service is not None:
+            desc = obj.service_description
+            if self.service == '':
+                if desc is not None:
+                    return False
+            elif desc is None or not self.service.match(desc):
+                return False
+        if self.author is not None and obj.author != self.author:
+            return False
+        if self.comment is not None and self.comment not in obj.comment:
+            return False
+        if self.start is not None or self.end is not None:
+            if isinstance(obj, Comment):
+                first = last = obj.entry_time
+            else:
+                first, last = obj.start_time, obj.end_time
+            if self.start is not None and last < self.start:
+                return False
+            if self.end is not None and first > self.end:
+                return False
+        return True
+
+def _records(status, blocks, cached):
+    if isinstance(status, StatusCache):
+        status.maybe_refresh()
+        return getattr(status, cached).values()
+    # only downtime or comment blocks are built from status.dat
+    return (obj for _, obj in iter_status(status, blocks))
+
+def find_downtimes(status, **filter):
+    """
+    Return list of Downtime of 'status' (StatusCache or status.dat path)
+    matching Filter(**filter)
+    """
+    match = Filter(**filter)
+    return [d for d in _records(status, _DOWNTIME_BLOCKS, 'downtimes_by_id')
+            if match(d)]
+
+def find_comments(status, **filter):
+    """
+    Return list of Comment of 'status' (StatusCache or status.dat path)
+    matching Filter(**filter)
+    """
+    match = Filter(**filter)
+    return [c for c in _records(status, _COMMENT_BLOCKS, 'comments_by_id')
+            if match(c)]
+
+def _check_criteria(filter, all):
+    if not all and not any(v is not None for v in filter.values()):
+        raise ValueError('No filter criteria given, pass all=True to '
+                         'delete everything')
+
+def delete_downtimes(nagext, status, all=False, **filter):
+    """
+    Delete downtimes matching Filter(**filter) in one batch,
+    returns list of deleted Downtime
+
+    Raises:
+      ValueError: if no criteria are given and 'all' is false
+    """
+    _check_criteria(filter, all)
+    found = find_downtimes(status, **filter)
+    with nagext.batch():
+        for d in found:
+            if d.service_description is None:
+                nagext.del_host_downtime(d.downtime_id)
+            else:
+                nagext.del_svc_downtime(d.downtime_id)
+    return found
+
+def delete_comments(nagext, status, all=False, **filter):
+    """
+    Delete comments matching Filter(**filter) in one batch,
+    returns list of deleted Comment
+
+    Raises:
+      ValueError: if no criteria are given and 'all' is false
+    """
+    _check_criteria(filter, all)
+    found = find_comments(status, **filter)
+    with nagext.batch():
+        for c in found:
+            if c.service_description is None:
+                nagext.del_host_comment(c.comment_id)
+            else:
+                nagext.del_svc_comment(c.comment_id)
+    return found
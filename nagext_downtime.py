@@ -0,0 +1,120 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Bulk downtime of hosts following the parent/child host graph.
+
+    index = TopologyIndex('/var/cache/nagios3/objects.cache')
+    schedule_downtime(nagext, index, hosts, start, end,
+                      author='admin', comment='maintenance', triggered=True)
+
+Hosts whose whole subtree of child hosts is in maintenance get one
+propagated (or triggered) downtime at the topmost of them, other hosts
+get their own downtime. A host reachable from two propagated downtimes
+would be in downtime twice, so subtrees never overlap. Service downtimes
+are planned with nagext_planner. Everything is written in one batch.
+"""
+
+from collections import deque
+
+from nagext_planner import Planner
+
+def _full(index, targets):
+    """
+    Return set of hosts of 'targets' with all hosts beyond them in 'targets'
+    """
+    children = index.children
+    full = set()
+    done = set()
+    for root in targets:
+        if root in done:
+            continue
+        # iterative post-order, host graphs may be deep
+        stack = [(root, False)]
+        while stack:
+            host, expanded = stack.pop()
+            if expanded:
+                done.add(host)
+                if all(c in full for c in children.get(host, ())):
+                    full.add(host)
+                continue
+            if host in done:
+                continue
+            stack.append((host, True))
+            for c in children.get(host, ()):
+                if c in targets and c not in done:
+                    stack.append((c, False))
+    return full
+
+def plan_downtime(index, hosts, start_time, end_time, fixed=1, duration=0,
+                  author='', comment='', trigger_id=0, triggered=False,
+                  services=None):
+    """
+    Return list of (command, arguments) scheduling downtime of 'hosts'
+    over TopologyIndex 'index', with SCHEDULE_AND_PROPAGATE_HOST_DOWNTIME
+    or, if 'triggered', SCHEDULE_AND_PROPAGATE_TRIGGERED_HOST_DOWNTIME at
+    roots of subtrees in maintenance.
+
+    'services' are (host, description) pairs to put in downtime too,
+    True for all services of 'hosts'.
+    """
+    index.maybe_reload()
+    targets = set(hosts)
+    full = _full(index, targets)
+    args = (start_time, end_time, fixed, trigger_id, duration, author,
+            comment)
+    propagate = ('SCHEDULE_AND_PROPAGATE_TRIGGERED_HOST_DOWNTIME'
+                 if triggered else 'SCHEDULE_AND_PROPAGATE_HOST_DOWNTIME')
+    parents = index.parents
+    children = index.children
+    queue = deque(sorted(h for h in targets
+                         if not any(p in targets for p in parents.get(h, ()))))
+    covered = set()
+    plan = []
+    while queue:
+        host = queue.popleft()
+        if host in covered:
+            continue
+        if host in full and children.get(host):
+            subtree = index.subtree(host)
+            if covered.isdisjoint(subtree):
+                plan.append((propagate, (host,) + args))
+                covered.update(subtree)
+                continue
+        plan.append(('SCHEDULE_HOST_DOWNTIME', (host,) + args))
+        covered.add(host)
+        queue.extend(c for c in children.get(host, ())
+                     if c in targets and c not in covered)
+    if services is True:
+        services = [(h, s) for h in sorted(targets)
+                    for s in index.hosts.get(h, ())]
+    if services:
+        plan.extend(Planner(index).plan('SCHEDULE_SVC_DOWNTIME', services,
+                                        *args))
+    return plan
+
+def schedule_downtime(nagext, index, hosts, start_time, end_time, fixed=1,
+                      duration=0, author='', comment='', trigger_id=0,
+                      triggered=False, services=None):
+    """
+    Send plan_downtime() in one NagExt batch, returns the plan
+    """
+    plan = plan_downtime(index, hosts, start_time, end_time, fixed, duration,
+                         author, comment, trigger_id, triggered, services)
+    Planner(index).send(nagext, plan)
+    return plan
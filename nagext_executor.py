@@ -0,0 +1,241 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Parallel execution of Nagios plugins submitting results as passive checks.
+
+    executor = PluginExecutor(NagExt('/var/lib/nagios3/rw/nagios.cmd'))
+    executor.run([
+        Check('web1', 'HTTP', ['/usr/lib/nagios/plugins/check_http', '-H', 'web1']),
+        Check('web1', None, '/usr/lib/nagios/plugins/check_ping -H web1 ...'),
+    ])
+
+Checks run in a bounded thread pool (each plugin is its own process,
+in its own session so that a plugin timing out is killed with all its
+children), and results are written with process_service_check_result
+(or process_host_check_result when service is None) in NagExt batches.
+Plugin output is rendered with nagext_perfdata.PluginOutput, truncated
+so that the command line fits into Nagios command buffer.
+"""
+
+import os
+import signal
+import subprocess
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import time
+
+from nagext_perfdata import (OK, WARNING, CRITICAL, UNKNOWN, PluginOutput,
+                             max_output_length)
+
+class Check(object):
+    """
+    Plugin 'command' (argument list, or string run by shell) checking
+    service 'service_description' of 'host_name' (host itself if None)
+    """
+    __slots__ = ('host_name', 'service_description', 'command', 'timeout')
+
+    def __init__(self, host_name, service_description, command, timeout=None):
+        self.host_name = host_name
+        self.service_description = service_description
+        self.command = command
+        self.timeout = timeout
+
+class CheckResult(object):
+    __slots__ = ('check', 'return_code', 'output', 'long_output', 'perfdata',
+                 'started', 'runtime', 'timed_out')
+
+    def __init__(self, check, return_code, output, long_output, perfdata,
+                 started, runtime, timed_out=False):
+        self.check = check
+        self.return_code = return_code
+        self.output = output
+        self.long_output = long_output
+        self.perfdata = perfdata
+        self.started = started
+        self.runtime = runtime
+        self.timed_out = timed_out
+
+    def plugin_output(self):
+        """
+        Return output, perfdata and long output in one line as Nagios
+        expects in passive check results, see nagext_perfdata
+        """
+        check = self.check
+        out = PluginOutput(self.output, max_output_length(
+            check.host_name, check.service_description))
+        if self.perfdata:
+            out.add_perfdata(self.perfdata)
+        if self.long_output:
+            out.add_long(self.long_output)
+        return out.render()
+
+def parse_output(text):
+    """
+    Split plugin output into (output, long_output, perfdata).
+
+    First line is 'output|perfdata', following lines are long output
+    which may end with '|perfdata' continued to the last line.
+    """
+    first, _, rest = text.rstrip('\n').partition('\n')
+    output, _, perfdata = first.partition('|')
+    long_output, _, more_perfdata = rest.partition('|')
+    perfdata = ' '.join(p.strip() for p in
+                        (perfdata, more_perfdata.replace('\n', ' '))
+                        if p.strip())
+    return output.strip(), long_output.strip('\n'), perfdata
+
+class CheckStats(object):
+    """
+    Runtime statistics of one check
+    """
+    __slots__ = ('count', 'total_runtime', 'max_runtime', 'last_runtime',
+                 'timeouts', 'last_return_code')
+
+    def __init__(self):
+        self.count = 0
+        self.total_runtime = 0.0
+        self.max_runtime = 0.0
+        self.last_runtime = 0.0
+        self.timeouts = 0
+        self.last_return_code = None
+
+    @property
+    def mean_runtime(self):
+        return self.total_runtime / self.count if self.count else 0.0
+
+    def as_dict(self):
+        return dict((name, getattr(self, name))
+                    for name in self.__slots__ + ('mean_runtime',))
+
+class PluginExecutor(object):
+    """
+    Runs checks with at most 'max_workers' plugins at a time, killing
+    plugins running longer than 'timeout' seconds (or Check.timeout),
+    and submits results through 'nagext' in batches of 'batch_size'.
+
+    Per check statistics are kept in 'stats' keyed by
+    (host_name, service_description); if nagext has metrics, runtimes are
+    also observed in 'check_runtime' histogram and 'checks' and
+    'check_timeouts' counters.
+    """
+
+    def __init__(self, nagext, max_workers=16, timeout=60, batch_size=100):
+        self.nagext = nagext
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def execute(self, check):
+        """
+        Run one check plugin and return its CheckResult
+        """
+        timeout = check.timeout or self.timeout
+        started = time()
+        try:
+            # own process group, killed as a whole with shell and children
+            proc = subprocess.Popen(check.command,
+                                    shell=isinstance(check.command, str),
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    start_new_session=True)
+        except OSError as e:
+            return CheckResult(check, UNKNOWN,
+                               'UNKNOWN - plugin failed to run: %s' % e,
+                               '', '', started, time() - started)
+        try:
+            stdout, _ = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            proc.communicate()
+            return CheckResult(check, UNKNOWN,
+                               'UNKNOWN - plugin timed out after %s seconds' %
+                               timeout, '', '', started, time() - started, True)
+        runtime = time() - started
+        code = proc.returncode
+        if code not in (OK, WARNING, CRITICAL, UNKNOWN):
+            code = UNKNOWN
+        output, long_output, perfdata = parse_output(
+            stdout.decode('utf-8', 'replace'))
+        if not output:
+            output = '(No output returned from plugin)'
+        return CheckResult(check, code, output, long_output, perfdata,
+                           started, runtime)
+
+    def _account(self, result):
+        check = result.check
+        key = (check.host_name, check.service_description)
+        with self._lock:
+            s = self.stats.get(key)
+            if s is None:
+                s = self.stats[key] = CheckStats()
+            s.count += 1
+            s.total_runtime += result.runtime
+            s.max_runtime = max(s.max_runtime, result.runtime)
+            s.last_runtime = result.runtime
+            s.last_return_code = result.return_code
+            if result.timed_out:
+                s.timeouts += 1
+        metrics = self.nagext.metrics
+        if metrics is not None:
+            metrics.inc('checks')
+            if result.timed_out:
+                metrics.inc('check_timeouts')
+            metrics.observe('check_runtime', result.runtime)
+
+    def submit(self, results):
+        """
+        Write check 'results' to Nagios in one batch
+        """
+        nagext = self.nagext
+        with nagext.batch():
+            for r in results:
+                if r.check.service_description is None:
+                    nagext.process_host_check_result(
+                        r.check.host_name, r.return_code, r.plugin_output())
+                else:
+                    nagext.process_service_check_result(
+                        r.check.host_name, r.check.service_description,
+                        r.return_code, r.plugin_output())
+
+    def run(self, checks):
+        """
+        Run 'checks', submitting results as they complete.
+        Returns list of CheckResult in completion order.
+        """
+        results = []
+        pending = []
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            futures = [pool.submit(self.execute, c) for c in checks]
+            for f in as_completed(futures):
+                result = f.result()
+                self._account(result)
+                results.append(result)
+                pending.append(result)
+                if len(pending) >= self.batch_size:
+                    self.submit(pending)
+                    pending = []
+        if pending:
+            self.submit(pending)
+        return results
@@ -0,0 +1,164 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Livestatus transport for NagExt.
+
+    transport = LivestatusTransport(['/var/lib/nagios3/rw/live',
+                                     'backup.example.com:6557'])
+    nagext = NagExt(None, transport=transport)
+
+Commands are sent as 'COMMAND [time] command_id;arguments' requests, a
+whole batch written at once over one of at most 'pool_size' persistent
+connections, so one transport may be shared by NagExt objects in several
+threads. Addresses are Unix socket paths or 'host:port'; when one fails
+the next is used. Livestatus doesn't answer commands, so only connection
+failures are reported.
+"""
+
+import socket
+import threading
+
+from nagext import ExecError
+from nagext_qh import closed_by_peer
+
+def connect(address, timeout):
+    """
+    Return socket connected to Unix socket path or 'host:port' 'address'
+    """
+    if not address.startswith('/') and ':' in address:
+        host, _, port = address.rpartition(':')
+        return socket.create_connection((host, int(port)), timeout)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except (OSError, IOError):
+        sock.close()
+        raise
+    return sock
+
+class LivestatusTransport(object):
+    """
+    Pool of connections to the first working of Livestatus 'addresses'
+    """
+
+    def __init__(self, addresses, pool_size=4, timeout=10.0):
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        self.addresses = list(addresses)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.failovers = 0
+        self._current = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def __getstate__(self):
+        return {'addresses': self.addresses, 'pool_size': self.pool_size,
+                'timeout': self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _connect(self):
+        """
+        Connect to current address, failing over to the next ones
+        """
+        errors = []
+        n = len(self.addresses)
+        for i in range(n):
+            index = (self._current + i) % n
+            address = self.addresses[index]
+            try:
+                sock = connect(address, self.timeout)
+            except (OSError, IOError) as e:
+                errors.append('%s: %s' % (address, e))
+                continue
+            if index != self._current:
+                self._current = index
+                self.failovers += 1
+            return sock
+        raise ExecError('Can not connect to Livestatus: %s' %
+                        ', '.join(errors))
+
+    def open(self):
+        """
+        Check that Livestatus is reachable, keeping the connection
+
+        Raises:
+          ExecError: if no address accepts connections
+        """
+        self.close()
+        self._release(self._connect())
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock in idle:
+            sock.close()
+
+    def detach(self):
+        self.close()
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    sock = self._idle.pop() if self._idle else None
+                if sock is None:
+                    return self._connect()
+                if not closed_by_peer(sock):
+                    return sock
+                sock.close()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, sock):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(sock)
+                sock = None
+        if sock is not None:
+            sock.close()
+
+    def send(self, data):
+        """
+        Send command lines 'data' as Livestatus COMMAND requests
+
+        Raises:
+          ExecError: if sending fails
+        """
+        lines = [line for line in data.split(b'\n') if line]
+        request = b''.join([b'COMMAND ' + line + b'\n\n' for line in lines])
+        sock = self._acquire()
+        try:
+            sock.sendall(request)
+        except (OSError, IOError) as e:
+            sock.close()
+            # next connection starts from the next address
+            with self._lock:
+                self._current = (self._current + 1) % len(self.addresses)
+            raise ExecError(str(e))
+        else:
+            self._release(sock)
+        finally:
+            self._slots.release()
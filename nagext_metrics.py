@@ -0,0 +1,222 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Metrics of NagExt write path.
+
+    metrics = Metrics()
+    nagext = NagExt('/var/lib/nagios3/rw/nagios.cmd', metrics=metrics)
+    ...
+    metrics.snapshot()           # plain dict
+    metrics.render_prometheus()  # Prometheus text format
+    metrics.serve(9810)          # Prometheus endpoint on localhost:9810
+
+NagExt only calls Metrics when one is given, so there is no overhead
+when metrics are disabled.
+"""
+
+import threading
+
+from bisect import bisect_left
+
+# name -> help of counters and gauges known in advance
+COUNTERS = {
+    'bytes': 'Bytes written to command file',
+    'write_syscalls': 'write() calls on command file',
+    'flushes': 'Flushes of pending commands',
+    'partial_writes': 'Writes that wrote only part of data',
+    'reconnects': 'Reopens of command file',
+}
+
+GAUGES = {
+    'queue_depth': 'Commands waiting to be written',
+    'pipe_occupancy': 'Fraction of command file pipe buffer not read yet',
+    'batch_target': 'Commands per write chosen by adaptive pacing',
+}
+
+HISTOGRAMS = {
+    'write_latency': 'Seconds spent writing pending commands',
+}
+
+# help of metrics created on first use by helper modules
+HELP = {
+    'checks': 'Plugin checks executed',
+    'check_timeouts': 'Plugin checks killed on timeout',
+    'check_runtime': 'Seconds plugin checks were running',
+    'commands_accepted': 'Commands found in nagios.log',
+    'commands_missing': 'Commands not found in nagios.log in time',
+    'acceptance_latency': 'Seconds from command to its nagios.log entry',
+    'command_lag': 'Seconds from probe command to status.dat showing it',
+}
+
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+def _help(known, name):
+    return known.get(name) or HELP.get(name, name)
+
+class Histogram(object):
+    """
+    Histogram with fixed upper bounds of buckets
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        Return list of (upper bound, cumulative count), last bound is +Inf
+        """
+        result = []
+        total = 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """
+        Return upper bound of bucket containing 'q' quantile (0 <= q <= 1)
+        """
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank and total:
+                return bound
+        return 0.0
+
+class Metrics(object):
+    """
+    Counters, gauges and histograms of one or several NagExt objects
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = dict((name, 0) for name in COUNTERS)
+        self.gauges = dict((name, 0) for name in GAUGES)
+        self.histograms = dict((name, Histogram()) for name in HISTOGRAMS)
+        self.commands = {}
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = Histogram()
+            h.observe(value)
+
+    def command(self, cmd, count=1):
+        """
+        Count 'count' commands 'cmd' written
+        """
+        with self._lock:
+            self.commands[cmd] = self.commands.get(cmd, 0) + count
+
+    def snapshot(self):
+        """
+        Return current values as a dict
+        """
+        with self._lock:
+            result = dict(self.counters)
+            result.update(self.gauges)
+            result['commands'] = dict(self.commands)
+            for name, h in self.histograms.items():
+                result[name] = {
+                    'count': h.count,
+                    'sum': h.sum,
+                    'p50': h.quantile(0.5),
+                    'p99': h.quantile(0.99),
+                }
+        return result
+
+    def render_prometheus(self, prefix='nagext'):
+        """
+        Return metrics in Prometheus text exposition format
+        """
+        out = []
+        with self._lock:
+            out.append('# HELP %s_commands_total Commands written\n' % prefix)
+            out.append('# TYPE %s_commands_total counter\n' % prefix)
+            for cmd in sorted(self.commands):
+                out.append('%s_commands_total{command="%s"} %d\n' %
+                           (prefix, cmd, self.commands[cmd]))
+            for name in sorted(self.counters):
+                out.append('# HELP %s_%s_total %s\n' %
+                           (prefix, name, _help(COUNTERS, name)))
+                out.append('# TYPE %s_%s_total counter\n' % (prefix, name))
+                out.append('%s_%s_total %s\n' %
+                           (prefix, name, self.counters[name]))
+            for name in sorted(self.gauges):
+                out.append('# HELP %s_%s %s\n' %
+                           (prefix, name, _help(GAUGES, name)))
+                out.append('# TYPE %s_%s gauge\n' % (prefix, name))
+                out.append('%s_%s %s\n' % (prefix, name, self.gauges[name]))
+            for name in sorted(self.histograms):
+                h = self.histograms[name]
+                full = '%s_%s_seconds' % (prefix, name)
+                out.append('# HELP %s %s\n' %
+                           (full, _help(HISTOGRAMS, name)))
+                out.append('# TYPE %s histogram\n' % full)
+                for bound, total in h.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    out.append('%s_bucket{le="%s"} %d\n' % (full, le, total))
+                out.append('%s_sum %r\n' % (full, h.sum))
+                out.append('%s_count %d\n' % (full, h.count))
+        return ''.join(out)
+
+    def serve(self, port, host='127.0.0.1', prefix='nagext'):
+        """
+        Serve Prometheus metrics over HTTP in a daemon thread,
+        returns the server (call its shutdown() to stop)
+        """
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render_prometheus(prefix).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer((host, port), Handler)
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+        return server
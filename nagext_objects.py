@@ -0,0 +1,335 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Index of Nagios objects from objects.cache and validation of command
+arguments against it.
+
+    index = ObjectIndex('/var/cache/nagios3/objects.cache')
+    Validator(index).attach(nagext)
+    nagext.schedule_host_downtime('no-such-host', ...)  # raises ValidationError
+
+The index is rebuilt only when objects.cache changes (Nagios rewrites it
+on every start), checked at most every 'check_interval' seconds.
+"""
+
+import mmap
+import os
+import sys
+
+from time import time
+
+from nagext import ExecError, commands
+
+class ValidationError(ExecError):
+    """
+    Command refers to an object Nagios doesn't know
+    """
+    pass
+
+def iter_objects(path, wanted):
+    """
+    Iterate over (object type, {attribute: value}) of objects.cache 'path'
+    for object types and attributes in 'wanted' dict
+    {object type: set of attributes}
+    """
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return
+    wanted = dict((k.encode(), set(a.encode() for a in v))
+                  for k, v in wanted.items())
+    try:
+        kind = None
+        attrs = None
+        obj = None
+        for line in iter(mm.readline, b''):
+            line = line.strip()
+            if kind is None:
+                if line.startswith(b'define '):
+                    kind = line[7:].rstrip(b'{').strip()
+                    attrs = wanted.get(kind)
+                    obj = {}
+            elif line == b'}':
+                if attrs is not None:
+                    yield kind.decode(), obj
+                kind = None
+            elif attrs is not None:
+                key, _, value = line.partition(b'\t')
+                if key in attrs:
+                    obj[key.decode()] = value.strip().decode('utf-8')
+    finally:
+        mm.close()
+
+_NAMES = {
+    'host': 'host_name',
+    'hostgroup': 'hostgroup_name',
+    'servicegroup': 'servicegroup_name',
+    'contact': 'contact_name',
+    'contactgroup': 'contactgroup_name',
+    'timeperiod': 'timeperiod_name',
+}
+
+class ObjectIndex(object):
+    """
+    Names of hosts, services, host and service groups, contacts, contact
+    groups and timeperiods defined in objects.cache 'path'.
+
+    Services are kept as host name -> frozenset of service descriptions,
+    descriptions and equal sets being shared as most of them repeat
+    across hosts.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.hosts = {}
+        self.names = dict((kind, frozenset()) for kind in _NAMES)
+        self._stamp = None
+        self._checked = 0
+        self.reload()
+
+    def _wanted(self):
+        wanted = dict((kind, set([attr])) for kind, attr in _NAMES.items())
+        wanted['service'] = set(['host_name', 'service_description'])
+        return wanted
+
+    def _add(self, kind, obj, services, names):
+        if kind == 'service':
+            services.setdefault(obj.get('host_name'), []).append(
+                sys.intern(obj.get('service_description', '')))
+        else:
+            names[kind].add(obj.get(_NAMES[kind]))
+
+    def reload(self, force=False):
+        """
+        Rebuild index if objects.cache changed, returns True if rebuilt
+
+        Raises:
+          OSError: if objects.cache can't be read
+        """
+        self._checked = time()
+        st = os.stat(self.path)
+        stamp = (st.st_ino, st.st_size, st.st_mtime)
+        if stamp == self._stamp and not force:
+            return False
+        services = {}
+        names = dict((kind, set()) for kind in _NAMES)
+        for kind, obj in iter_objects(self.path, self._wanted()):
+            self._add(kind, obj, services, names)
+        empty = frozenset()
+        hosts = dict((h, empty) for h in names['host'])
+        # hosts made from the same templates share one set of services
+        shared = {}
+        for h, descriptions in services.items():
+            descriptions = frozenset(descriptions)
+            hosts[h] = shared.setdefault(descriptions, descriptions)
+        # swap at once so lookups never see a half built index
+        self.hosts = hosts
+        self.names = dict((kind, frozenset(v)) for kind, v in names.items())
+        self._stamp = stamp
+        return True
+
+    def maybe_reload(self):
+        """
+        Reload if 'check_interval' passed since last check
+        """
+        if time() - self._checked >= self.check_interval:
+            self.reload()
+
+    def has_host(self, name):
+        return name in self.hosts
+
+    def has_service(self, host_name, description):
+        return description in self.hosts.get(host_name, ())
+
+    def has(self, kind, name):
+        return name in self.names[kind]
+
+# argument names of generated methods by object type they refer to
+_ARGS = {
+    'hostgroup_name': 'hostgroup',
+    'servicegroup_name': 'servicegroup',
+    'contact_name': 'contact',
+    'contactgroup_name': 'contactgroup',
+    'timeperiod': 'timeperiod',
+    'check_timeperiod': 'timeperiod',
+    'notification_timeperiod': 'timeperiod',
+}
+
+def _checks(argnames):
+    """
+    Return list of (object type, argument positions) to validate
+    """
+    checks = []
+    for i, name in enumerate(argnames):
+        if name == 'host_name':
+            if (i + 1 < len(argnames) and
+                    argnames[i + 1] == 'service_description'):
+                checks.append(('service', (i, i + 1)))
+            else:
+                checks.append(('host', (i,)))
+        elif name in _ARGS:
+            checks.append((_ARGS[name], (i,)))
+    return checks
+
+class Validator(object):
+    """
+    Rejects commands naming objects missing from ObjectIndex 'index'
+    with ValidationError. Use as NagExt pre hook, see attach().
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._checks = {}
+        for cmd, argnames in commands().items():
+            checks = _checks(argnames)
+            if checks:
+                self._checks[cmd] = checks
+
+    def attach(self, nagext):
+        nagext.add_hook(pre=self)
+
+    def detach(self, nagext):
+        nagext.remove_hook(pre=self)
+
+    def __call__(self, cmd, args):
+        checks = self._checks.get(cmd)
+        if checks is None:
+            return
+        index = self.index
+        index.maybe_reload()
+        for kind, pos in checks:
+            try:
+                names = [str(args[i]) for i in pos]
+            except IndexError:
+                continue
+            if kind == 'service':
+                ok = index.has_service(names[0], names[1])
+            elif kind == 'host':
+                ok = index.has_host(names[0])
+            else:
+                ok = index.has(kind, names[0])
+            if not ok:
+                raise ValidationError('%s: unknown %s "%s"' %
+                                      (cmd, kind, ';'.join(names)))
+
+class GroupIndex(ObjectIndex):
+    """
+    ObjectIndex also keeping members of host and service groups:
+    'hostgroups' as group name -> frozenset of host names and
+    'servicegroups' as group name -> frozenset of (host, description)
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.hostgroups = {}
+        self.servicegroups = {}
+        self._loading = None
+        ObjectIndex.__init__(self, path, check_interval)
+
+    def _wanted(self):
+        wanted = ObjectIndex._wanted(self)
+        wanted['hostgroup'].add('members')
+        wanted['servicegroup'].add('members')
+        return wanted
+
+    def _add(self, kind, obj, services, names):
+        ObjectIndex._add(self, kind, obj, services, names)
+        if kind not in ('hostgroup', 'servicegroup'):
+            return
+        members = [m.strip() for m in obj.get('members', '').split(',')
+                   if m.strip()]
+        if kind == 'hostgroup':
+            self._loading['hostgroups'][obj.get('hostgroup_name')] = \
+                frozenset(members)
+        else:
+            # host1,service1,host2,service2...
+            self._loading['servicegroups'][obj.get('servicegroup_name')] = \
+                frozenset(zip(members[::2], members[1::2]))
+
+    def _new_state(self):
+        """
+        Return {attribute: empty value} of attributes built by _add()
+        """
+        return {'hostgroups': {}, 'servicegroups': {}}
+
+    def reload(self, force=False):
+        self._loading = self._new_state()
+        try:
+            if not ObjectIndex.reload(self, force):
+                return False
+            for name, value in self._loading.items():
+                setattr(self, name, value)
+            return True
+        finally:
+            self._loading = None
+
+    def host_services(self, host_name):
+        """
+        Return set of (host, description) of all services of 'host_name'
+        """
+        return set((host_name, s) for s in self.hosts.get(host_name, ()))
+
+class TopologyIndex(GroupIndex):
+    """
+    GroupIndex also keeping the host graph: 'parents' and 'children' as
+    host name -> list of host names
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.parents = {}
+        self.children = {}
+        GroupIndex.__init__(self, path, check_interval)
+
+    def _wanted(self):
+        wanted = GroupIndex._wanted(self)
+        wanted['host'].add('parents')
+        return wanted
+
+    def _new_state(self):
+        state = GroupIndex._new_state(self)
+        state['parents'] = {}
+        state['children'] = {}
+        return state
+
+    def _add(self, kind, obj, services, names):
+        GroupIndex._add(self, kind, obj, services, names)
+        if kind == 'host' and obj.get('parents'):
+            host = obj['host_name']
+            parents = [p.strip() for p in obj['parents'].split(',')
+                       if p.strip()]
+            self._loading['parents'][host] = parents
+            children = self._loading['children']
+            for p in parents:
+                children.setdefault(p, []).append(host)
+
+    def subtree(self, host_name):
+        """
+        Return set of 'host_name' and all hosts beyond it
+        """
+        found = set([host_name])
+        stack = [host_name]
+        children = self.children
+        while stack:
+            for child in children.get(stack.pop(), ()):
+                if child not in found:
+                    found.add(child)
+                    stack.append(child)
+        return found
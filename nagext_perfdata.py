@@ -0,0 +1,241 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Plugin output and performance data formatting for passive check results.
+
+    out = PluginOutput('OK - disk usage 42%')
+    out.add_perf('/', 42, '%', warn=80, crit=90, minimum=0, maximum=100)
+    out.add_long('/ is on /dev/sda1')
+    nagext.process_service_check_result(host, 'Disk', 0, out.render())
+
+Text and long output are escaped for the command file ('\\' and newlines
+as \\\\ and \\n, which Nagios unescapes, '|' replaced as it starts
+perfdata), perfdata labels are quoted when needed, units are normalised
+and the result is truncated to 'max_length' bytes of UTF-8 without
+splitting characters or escapes, dropping long output before perfdata.
+Text, long output and labels may be given as UTF-8 bytes.
+
+Nagios reads a command file line, with the passive check result command
+and names in front of the output, into MAX_EXTERNAL_COMMAND_LENGTH bytes.
+max_output_length() returns what is left of it for the output; the
+default 'max_length' leaves room for names of up to 'NAME_LENGTH' bytes.
+"""
+
+# plugin return codes and check states
+OK, WARNING, CRITICAL, UNKNOWN = range(4)
+
+STATE_NAMES = ('OK', 'WARNING', 'CRITICAL', 'UNKNOWN')
+
+# Nagios MAX_PLUGIN_OUTPUT_LENGTH
+MAX_PLUGIN_OUTPUT_LENGTH = 8192
+
+# Nagios MAX_EXTERNAL_COMMAND_LENGTH, including newline and NUL
+MAX_EXTERNAL_COMMAND_LENGTH = 8192
+
+# host and service names assumed by default 'max_length'
+NAME_LENGTH = 255
+
+def max_output_length(host_name, service_description=None):
+    """
+    Return bytes left for plugin output in a passive check result command
+    line of 'host_name' (and 'service_description')
+    """
+    names = [host_name]
+    if service_description is None:
+        cmd = 'PROCESS_HOST_CHECK_RESULT'
+    else:
+        cmd = 'PROCESS_SERVICE_CHECK_RESULT'
+        names.append(service_description)
+    # '[timestamp] cmd;names;return code;' and '\n\0' after output
+    overhead = len('[0000000000] %s;0;' % cmd) + 2 + sum(
+        len(n if isinstance(n, bytes) else n.encode('utf-8')) + 1
+        for n in names)
+    return min(MAX_EXTERNAL_COMMAND_LENGTH - overhead,
+               MAX_PLUGIN_OUTPUT_LENGTH)
+
+DEFAULT_MAX_LENGTH = max_output_length('h' * NAME_LENGTH, 's' * NAME_LENGTH)
+
+# unit aliases -> units of Nagios plugin development guidelines
+UNITS = {
+    '': '',
+    's': 's', 'sec': 's', 'secs': 's', 'second': 's', 'seconds': 's',
+    'ms': 'ms', 'msec': 'ms', 'milliseconds': 'ms',
+    'us': 'us', 'usec': 'us', 'microseconds': 'us',
+    '%': '%', 'percent': '%',
+    'b': 'B', 'B': 'B', 'byte': 'B', 'bytes': 'B',
+    'kb': 'KB', 'KB': 'KB', 'kB': 'KB', 'KiB': 'KB',
+    'mb': 'MB', 'MB': 'MB', 'MiB': 'MB',
+    'gb': 'GB', 'GB': 'GB', 'GiB': 'GB',
+    'tb': 'TB', 'TB': 'TB', 'TiB': 'TB',
+    'c': 'c', 'counter': 'c',
+}
+
+_ESCAPE = str.maketrans({'\\': '\\\\', '\n': '\\n', '\r': '', '|': '/'})
+
+# encoded perfdata labels, reused for repeated labels
+_labels = {}
+_LABELS_MAX = 4096
+
+def escape(text):
+    """
+    Return 'text' (str or UTF-8 bytes) escaped for plugin output as bytes
+    """
+    if isinstance(text, bytes):
+        return (text.replace(b'\\', b'\\\\').replace(b'\n', b'\\n')
+                .replace(b'\r', b'').replace(b'|', b'/'))
+    return text.translate(_ESCAPE).encode('utf-8')
+
+def label(name):
+    """
+    Return perfdata label 'name' quoted if needed, as bytes
+    """
+    encoded = _labels.get(name)
+    if encoded is not None:
+        return encoded
+    s = name.decode('utf-8') if isinstance(name, bytes) else name
+    s = s.translate(_ESCAPE).replace(';', '_')
+    if set(s) & set(" ='"):
+        s = "'%s'" % s.replace("'", "''")
+    encoded = s.encode('utf-8')
+    if len(_labels) >= _LABELS_MAX:
+        _labels.clear()
+    _labels[name] = encoded
+    return encoded
+
+def unit(uom):
+    """
+    Return normalised unit of measurement
+
+    Raises:
+      ValueError: if 'uom' is unknown
+    """
+    try:
+        return UNITS[uom]
+    except KeyError:
+        raise ValueError('Unknown unit of measurement "%s"' % uom)
+
+def _num(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if value != value:
+            return 'U'
+        return format(value, '.12g')
+    return str(value)
+
+def perfdata(name, value, uom='', warn=None, crit=None, minimum=None,
+             maximum=None):
+    """
+    Return one perfdata item 'label=value[uom];warn;crit;min;max' as bytes
+    """
+    item = b'%s=%s%s;%s;%s;%s;%s' % (
+        label(name), _num(value).encode(), unit(uom).encode(),
+        _num(warn).encode(), _num(crit).encode(), _num(minimum).encode(),
+        _num(maximum).encode())
+    return item.rstrip(b';')
+
+def _cut(data, limit):
+    """
+    Cut escaped UTF-8 'data' to at most 'limit' bytes on a character
+    boundary, not leaving half of an escape at the end
+    """
+    if len(data) <= limit:
+        return data
+    data = data[:max(limit, 0)]
+    # drop a multi-byte character cut in the middle
+    end = len(data)
+    while end and data[end - 1] & 0xC0 == 0x80:
+        end -= 1
+    if end and data[end - 1] >= 0xC0:
+        lead = data[end - 1]
+        size = 2 if lead < 0xE0 else 3 if lead < 0xF0 else 4
+        if len(data) - end + 1 < size:
+            data = data[:end - 1]
+    # odd number of trailing backslashes is a cut escape
+    stripped = data.rstrip(b'\\')
+    if (len(data) - len(stripped)) % 2:
+        data = data[:-1]
+    return data
+
+class PluginOutput(object):
+    """
+    Builder of plugin output: text, perfdata items and long output lines
+    """
+
+    def __init__(self, text=b'', max_length=DEFAULT_MAX_LENGTH):
+        self.max_length = max_length
+        self._text = escape(text)
+        self._perf = []
+        self._long = []
+
+    def set_text(self, text):
+        self._text = escape(text)
+
+    def add_perf(self, name, value, uom='', warn=None, crit=None,
+                 minimum=None, maximum=None):
+        self._perf.append(perfdata(name, value, uom, warn, crit, minimum,
+                                   maximum))
+
+    def add_perfdata(self, data):
+        """
+        Add already formatted perfdata items 'data' (str or UTF-8 bytes)
+        """
+        data = escape(data).strip()
+        if data:
+            self._perf.append(data)
+
+    def add_long(self, line):
+        self._long.append(escape(line))
+
+    def clear(self):
+        """
+        Forget perfdata and long output to reuse the builder
+        """
+        del self._perf[:]
+        del self._long[:]
+
+    def render_bytes(self):
+        """
+        Return plugin output as UTF-8 bytes truncated to 'max_length'
+        """
+        limit = self.max_length
+        perf = b' '.join(self._perf)
+        long_output = b'\\n'.join(self._long)
+        text = self._text
+        size = len(text) + (len(perf) + 1 if perf else 0)
+        if size > limit:
+            # no room for long output, keep as much text as fits with perf
+            long_output = b''
+            if len(perf) + 1 >= limit:
+                perf = b''
+            text = _cut(text, limit - (len(perf) + 1 if perf else 0))
+        elif long_output:
+            long_output = _cut(long_output, limit - size - 2)
+        out = text
+        if perf:
+            out += b'|' + perf
+        if long_output:
+            out += b'\\n' + long_output
+        return out
+
+    def render(self):
+        """
+        Return plugin output as str, suitable for NagExt methods
+        """
+        return self.render_bytes().decode('utf-8')
@@ -0,0 +1,167 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Planning of per host or per service commands as host and service group
+commands.
+
+    planner = Planner(GroupIndex('/var/cache/nagios3/objects.cache'))
+    plan = planner.plan('DISABLE_HOST_NOTIFICATIONS', hosts)
+    plan = planner.plan('SCHEDULE_SVC_DOWNTIME', services, start, end,
+                        1, 0, 0, 'admin', 'maintenance')
+    planner.send(nagext, plan)
+
+Targets (host names, or (host, description) pairs for service commands)
+are covered greedily by the largest hostgroups, servicegroups or hosts
+(for commands on all services of a host) whose members all are targets,
+the rest gets per object commands. Downtimes are never scheduled twice
+for the same object, so groups used for them don't overlap.
+"""
+
+import heapq
+
+from nagext import ExecError
+
+# per object command -> (target kind, {group kind: group command})
+PLANS = {}
+
+for _action in ('ENABLE', 'DISABLE'):
+    for _kind, _cmd, _group_cmd, _host_cmd in (
+            ('host', 'HOST_CHECK', 'HOST_CHECKS', None),
+            ('host', 'HOST_NOTIFICATIONS', 'HOST_NOTIFICATIONS', None),
+            ('host', 'PASSIVE_HOST_CHECKS', 'PASSIVE_HOST_CHECKS', None),
+            ('service', 'SVC_CHECK', 'SVC_CHECKS', 'HOST_SVC_CHECKS'),
+            ('service', 'SVC_NOTIFICATIONS', 'SVC_NOTIFICATIONS',
+             'HOST_SVC_NOTIFICATIONS'),
+            ('service', 'PASSIVE_SVC_CHECKS', 'PASSIVE_SVC_CHECKS', None)):
+        _groups = {
+            'hostgroup': '%s_HOSTGROUP_%s' % (_action, _group_cmd),
+            'servicegroup': '%s_SERVICEGROUP_%s' % (_action, _group_cmd),
+        }
+        if _host_cmd:
+            _groups['host'] = '%s_%s' % (_action, _host_cmd)
+        PLANS['%s_%s' % (_action, _cmd)] = (_kind, _groups)
+
+PLANS['SCHEDULE_HOST_DOWNTIME'] = ('host', {
+    'hostgroup': 'SCHEDULE_HOSTGROUP_HOST_DOWNTIME',
+    'servicegroup': 'SCHEDULE_SERVICEGROUP_HOST_DOWNTIME',
+})
+PLANS['SCHEDULE_SVC_DOWNTIME'] = ('service', {
+    'hostgroup': 'SCHEDULE_HOSTGROUP_SVC_DOWNTIME',
+    'servicegroup': 'SCHEDULE_SERVICEGROUP_SVC_DOWNTIME',
+    'host': 'SCHEDULE_HOST_SVC_DOWNTIME',
+})
+
+# commands which must not be applied twice to an object
+NO_OVERLAP = frozenset(['SCHEDULE_HOST_DOWNTIME', 'SCHEDULE_SVC_DOWNTIME'])
+
+class Planner(object):
+    """
+    Plans commands over GroupIndex 'index' (see nagext_objects)
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def _candidates(self, kind, groups, targets):
+        """
+        Iterate over (group kind, name, members) of groups with all
+        members in 'targets'
+        """
+        index = self.index
+        if kind == 'host':
+            if 'hostgroup' in groups:
+                for name, hosts in index.hostgroups.items():
+                    if hosts and hosts <= targets:
+                        yield 'hostgroup', name, hosts
+            if 'servicegroup' in groups:
+                for name, services in index.servicegroups.items():
+                    hosts = frozenset(h for h, _ in services)
+                    if hosts and hosts <= targets:
+                        yield 'servicegroup', name, hosts
+            return
+        if 'servicegroup' in groups:
+            for name, services in index.servicegroups.items():
+                if services and services <= targets:
+                    yield 'servicegroup', name, services
+        # hosts with all their services targeted
+        full = {}
+        for host in sorted(set(h for h, _ in targets)):
+            services = index.host_services(host)
+            if services and services <= targets:
+                full[host] = services
+        if 'hostgroup' in groups:
+            for name, hosts in index.hostgroups.items():
+                if hosts and all(h in full for h in hosts):
+                    yield 'hostgroup', name, frozenset().union(
+                        *(full[h] for h in hosts))
+        if 'host' in groups:
+            for host, services in full.items():
+                yield 'host', host, services
+
+    def plan(self, cmd, targets, *args):
+        """
+        Return list of (command, arguments) doing 'cmd' with 'args' for
+        each of 'targets'
+
+        Raises:
+          ExecError: if 'cmd' has no group commands
+        """
+        try:
+            kind, groups = PLANS[cmd]
+        except KeyError:
+            raise ExecError('No group commands for %s' % cmd)
+        targets = frozenset(tuple(t) if kind == 'service' else t
+                            for t in targets)
+        self.index.maybe_reload()
+        no_overlap = cmd in NO_OVERLAP
+        heap = [(-len(members), i, group, name, members)
+                for i, (group, name, members) in
+                enumerate(self._candidates(kind, groups, targets))]
+        heapq.heapify(heap)
+        covered = set()
+        plan = []
+        while heap:
+            _, i, group, name, members = heapq.heappop(heap)
+            if no_overlap:
+                gain = len(members) if covered.isdisjoint(members) else 0
+            else:
+                gain = len(members) - len(covered.intersection(members))
+            # a group command has to replace at least two commands
+            if gain < 2:
+                continue
+            if heap and gain < -heap[0][0]:
+                # gain shrank, retry after larger candidates
+                heapq.heappush(heap, (-gain, i, group, name, members))
+                continue
+            plan.append((groups[group], (name,) + args))
+            covered.update(members)
+        for target in sorted(targets - covered):
+            if kind == 'service':
+                plan.append((cmd, target + args))
+            else:
+                plan.append((cmd, (target,) + args))
+        return plan
+
+    def send(self, nagext, plan):
+        """
+        Write commands of 'plan' in one NagExt batch
+        """
+        with nagext.batch():
+            for cmd, args in plan:
+                nagext.run(cmd, *args)
@@ -0,0 +1,187 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Probe of command processing lag.
+
+    probe = LagProbe(nagext, '/var/cache/nagios3/status.dat', 'nagext-probe',
+                     service_description='Command lag', warning=30,
+                     critical=120)
+    probe.start()
+    probe.lag   # seconds
+
+Every 'interval' seconds a sentinel is written with change_custom_host_var
+to dummy host 'host_name', which must define custom variable _NAGEXT_PROBE
+(or 'varname'). status.dat is checked with os.stat every 'check_interval'
+seconds, and only when it was rewritten the host's block is looked up.
+Lag is the time from sending a sentinel to the status.dat written with
+it, so it includes up to status_update_interval of Nagios; while the last
+sentinel is not seen lag grows with time. Lag is set as 'command_lag'
+gauge of nagext metrics and, if 'service_description' is given, submitted
+as a passive check result of the dummy host.
+"""
+
+import os
+import threading
+
+from collections import OrderedDict
+from time import time
+
+from nagext_perfdata import OK, WARNING, CRITICAL, STATE_NAMES, PluginOutput
+from nagext_status import read_object
+
+class LagProbe(object):
+    """
+    Measures how long Nagios takes to process commands written through
+    'nagext', by sentinels sent to dummy host 'host_name'
+    """
+
+    def __init__(self, nagext, status_path, host_name, varname='NAGEXT_PROBE',
+                 interval=60.0, check_interval=1.0, service_description=None,
+                 warning=None, critical=None):
+        self.nagext = nagext
+        self.status_path = status_path
+        self.host_name = host_name
+        self.varname = varname.upper()
+        self.interval = interval
+        self.check_interval = check_interval
+        self.service_description = service_description
+        self.warning = warning
+        self.critical = critical
+        self.last_lag = None
+        # sentinels differ between runs so old values are not mistaken
+        self._run = '%x' % int(time())
+        self._seq = 0
+        # sequence number -> time sent, oldest first
+        self._outstanding = OrderedDict()
+        self._sent = 0
+        self._mtime = None
+        self._stop = None
+        self._thread = None
+
+    @property
+    def lag(self):
+        """
+        Current lag in seconds, None until the first sentinel is seen
+        """
+        if self._outstanding:
+            waiting = time() - next(iter(self._outstanding.values()))
+            if self.last_lag is None or waiting > self.last_lag:
+                return waiting
+        return self.last_lag
+
+    def send(self, now=None):
+        """
+        Write next sentinel
+        """
+        if now is None:
+            now = time()
+        self._seq += 1
+        self._outstanding[self._seq] = now
+        self._sent = now
+        self.nagext.change_custom_host_var(
+            self.host_name, self.varname, '%s-%d' % (self._run, self._seq))
+
+    def check(self):
+        """
+        Look for sentinels in status.dat if it was rewritten,
+        returns True if a new one was seen
+        """
+        try:
+            mtime = os.stat(self.status_path).st_mtime
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        host = read_object(self.status_path, 'hoststatus', self.host_name)
+        if host is None or not host.custom:
+            return False
+        run, _, seq = host.custom.get(self.varname, '').partition('-')
+        if run != self._run or not seq.isdigit():
+            return False
+        seq = int(seq)
+        if seq not in self._outstanding:
+            return False
+        # status.dat is written at once, its mtime is when it was written
+        self.last_lag = max(mtime - self._outstanding[seq], 0.0)
+        while self._outstanding:
+            s, _ = self._outstanding.popitem(last=False)
+            if s == seq:
+                break
+        return True
+
+    def state(self, lag):
+        if self.critical is not None and lag >= self.critical:
+            return CRITICAL
+        if self.warning is not None and lag >= self.warning:
+            return WARNING
+        return OK
+
+    def report(self):
+        """
+        Export current lag as metric and passive check result
+        """
+        lag = self.lag
+        if lag is None:
+            return
+        metrics = self.nagext.metrics
+        if metrics is not None:
+            metrics.set('command_lag', lag)
+        if self.service_description is None:
+            return
+        state = self.state(lag)
+        out = PluginOutput('%s - command processing lag %.1fs' %
+                           (STATE_NAMES[state], lag))
+        out.add_perf('lag', round(lag, 3), 's', self.warning, self.critical,
+                     0)
+        self.nagext.process_service_check_result(
+            self.host_name, self.service_description, state, out.render())
+
+    def tick(self, now=None):
+        """
+        Check status.dat and, every 'interval' seconds, report lag and
+        send next sentinel
+        """
+        if now is None:
+            now = time()
+        if self.check():
+            self.report()
+        if now - self._sent >= self.interval:
+            self.report()
+            self.send(now)
+
+    def start(self):
+        """
+        Run probe in a thread
+        """
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.tick()
+            self._stop.wait(self.check_interval)
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,165 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Nagios 4 query handler transport for NagExt.
+
+    transport = QueryHandlerTransport('/var/lib/nagios4/rw/nagios.qh')
+    nagext = NagExt(None, transport=transport)
+    nagext.enable_host_check('web1')  # raises CommandRejected if refused
+
+Commands are sent as '@command run [time] command_id;arguments' queries
+over one persistent connection, up to 'window' queries at a time before
+reading their replies, which come back in order, NUL terminated, as
+'code: message'. Replies with codes of 400 and above are reported with
+CommandRejected after the whole batch is sent.
+"""
+
+import select
+import socket
+
+from nagext import ExecError
+
+def closed_by_peer(sock):
+    """
+    Return True if idle connection 'sock' was closed by the other side
+    (Nagios restarted), without blocking
+    """
+    try:
+        if not select.select([sock], [], [], 0)[0]:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, IOError):
+        return True
+
+class CommandRejected(ExecError):
+    """
+    Nagios refused commands, 'replies' is a list of
+    (command line, code, message)
+    """
+
+    def __init__(self, replies):
+        ExecError.__init__(self, '%d commands rejected, first: %s: %s' % (
+            len(replies), replies[0][1], replies[0][2]))
+        self.replies = replies
+
+class QueryHandlerTransport(object):
+    """
+    Persistent connection to Nagios query handler socket 'path'.
+    'accepted' and 'rejected' count replies.
+    """
+
+    window = 512
+
+    def __init__(self, path, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+        self.accepted = 0
+        self.rejected = 0
+        self._sock = None
+        self._buf = b''
+
+    def __getstate__(self):
+        return {'path': self.path, 'timeout': self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def open(self):
+        """
+        Connect to query handler socket
+
+        Raises:
+          ExecError: if connection fails
+        """
+        self.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except (OSError, IOError) as e:
+            sock.close()
+            raise ExecError('Can not connect to "%s": %s' % (self.path, e))
+        self._sock = sock
+        self._buf = b''
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def detach(self):
+        self.close()
+
+    def _exchange(self, lines):
+        """
+        Send one window of command 'lines', return their replies
+        """
+        if self._sock is None or closed_by_peer(self._sock):
+            self.open()
+        query = b''.join([b'@command run ' + line + b'\0' for line in lines])
+        try:
+            self._sock.sendall(query)
+            replies = []
+            buf = self._buf
+            while len(replies) < len(lines):
+                end = buf.find(b'\0')
+                if end >= 0:
+                    replies.append(buf[:end])
+                    buf = buf[end + 1:]
+                    continue
+                data = self._sock.recv(65536)
+                if not data:
+                    raise ExecError('Connection closed by Nagios')
+                buf += data
+            self._buf = buf
+        except (OSError, IOError) as e:
+            # replies can't be matched to commands any more
+            self.close()
+            raise ExecError(str(e))
+        except ExecError:
+            self.close()
+            raise
+        return replies
+
+    def send(self, data):
+        """
+        Send command lines 'data' and wait for replies
+
+        Raises:
+          ExecError: on connection failure
+          CommandRejected: if Nagios refused some commands
+        """
+        lines = [line for line in data.split(b'\n') if line]
+        rejected = []
+        for i in range(0, len(lines), self.window):
+            window = lines[i:i + self.window]
+            for line, reply in zip(window, self._exchange(window)):
+                code, _, message = reply.partition(b':')
+                try:
+                    code = int(code)
+                except ValueError:
+                    code = 0
+                if 200 <= code < 400:
+                    self.accepted += 1
+                    continue
+                self.rejected += 1
+                rejected.append((line.decode('utf-8', 'replace'), code,
+                                 message.strip().decode('utf-8', 'replace')))
+        if rejected:
+            raise CommandRejected(rejected)
@@ -0,0 +1,126 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Reconciliation of Nagios state with desired state.
+
+    desired = {
+        'hosts': {'web1': {'notifications_enabled': False}},
+        'services': {'web1': {'HTTP': {'check_interval': 2,
+                                       'custom': {'OWNER': 'web'}}}},
+    }
+    reconciler = Reconciler(StatusCache('/var/cache/nagios3/status.dat'))
+    reconciler.apply(nagext, desired, dry_run=True)
+
+Only commands changing what differs from status.dat are produced, as
+(NagExt method name, arguments). Each desired object is looked up in the
+StatusCache dicts, so a diff costs one lookup per object and attribute.
+"""
+
+# attribute -> (host method, service method), boolean attributes get
+# enable_/disable_ prefix
+FLAGS = {
+    'active_checks_enabled': ('host_check', 'svc_check'),
+    'passive_checks_enabled': ('passive_host_checks', 'passive_svc_checks'),
+    'notifications_enabled': ('host_notifications', 'svc_notifications'),
+    'event_handler_enabled': ('host_event_handler', 'svc_event_handler'),
+    'flap_detection_enabled': ('host_flap_detection', 'svc_flap_detection'),
+}
+
+VALUES = {
+    'check_interval': ('change_normal_host_check_interval',
+                       'change_normal_svc_check_interval'),
+}
+
+CUSTOM = ('change_custom_host_var', 'change_custom_svc_var')
+
+class Reconciler(object):
+    """
+    Compares desired state with StatusCache 'status' (see nagext_status).
+
+    Desired state is a dict with 'hosts' as {host: attributes} and
+    'services' as {host: {description: attributes}}, attributes being
+    keys of FLAGS and VALUES and 'custom' as {variable: value}.
+    Objects missing from status.dat are listed in 'missing' after diff().
+    """
+
+    def __init__(self, status):
+        self.status = status
+        self.missing = []
+
+    def _diff(self, which, key, current, attrs, commands):
+        for attr, value in attrs.items():
+            if attr in FLAGS:
+                if bool(value) != getattr(current, attr):
+                    commands.append(('%s_%s' % (
+                        'enable' if value else 'disable', FLAGS[attr][which]),
+                        key))
+            elif attr in VALUES:
+                if float(value) != getattr(current, attr):
+                    commands.append((VALUES[attr][which], key + (value,)))
+            elif attr == 'custom':
+                custom = current.custom or {}
+                for name, v in value.items():
+                    # Nagios keeps custom variable names upper case
+                    if custom.get(name.upper()) != str(v):
+                        commands.append((CUSTOM[which], key + (name, v)))
+            else:
+                raise ValueError('Unknown attribute "%s"' % attr)
+
+    def diff(self, desired):
+        """
+        Return list of (NagExt method name, arguments) converging
+        Nagios state to 'desired'
+
+        Raises:
+          ValueError: on unknown attribute in 'desired'
+        """
+        status = self.status
+        status.maybe_refresh()
+        hosts = status.hosts
+        services = status.services_by_key
+        commands = []
+        missing = []
+        for host, attrs in desired.get('hosts', {}).items():
+            current = hosts.get(host)
+            if current is None:
+                missing.append((host, None))
+            else:
+                self._diff(0, (host,), current, attrs, commands)
+        for host, descriptions in desired.get('services', {}).items():
+            for description, attrs in descriptions.items():
+                current = services.get((host, description))
+                if current is None:
+                    missing.append((host, description))
+                else:
+                    self._diff(1, (host, description), current, attrs,
+                               commands)
+        self.missing = missing
+        return commands
+
+    def apply(self, nagext, desired, dry_run=False):
+        """
+        Send commands of diff() in one NagExt batch, unless 'dry_run'.
+        Returns list of commands.
+        """
+        commands = self.diff(desired)
+        if not dry_run:
+            with nagext.batch():
+                for method, args in commands:
+                    getattr(nagext, method)(*args)
+        return commands
@@ -0,0 +1,213 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Record and replay Nagios external command traffic.
+
+Commands sent through RecordingNagExt are appended to a gzip compressed
+journal, one command per line:
+timestamp<TAB>command_id;command_arguments
+
+The journal can later be replayed against a command file at original speed,
+scaled speed or as fast as possible.
+"""
+
+import gzip
+import os
+import sys
+
+from time import time, sleep
+
+from nagext import NagExt, format_args
+
+class Journal(object):
+    """
+    Gzip compressed journal of external commands
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self._f = gzip.open(path, mode + 't', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        """
+        Iterate over (timestamp, command_id, str_args) recorded in journal
+        """
+        for line in self._f:
+            ts, _, command = line.rstrip('\n').partition('\t')
+            cmd, _, str_args = command.partition(';')
+            yield float(ts), cmd, str_args
+
+    def write(self, timestamp, cmd, str_args):
+        self._f.write('%.6f\t%s;%s\n' % (timestamp, cmd, str_args))
+
+    def close(self):
+        self._f.close()
+
+    def detach(self):
+        """
+        Forget journal inherited from parent process, what it buffered
+        is not written again
+        """
+        null = os.open(os.devnull, os.O_WRONLY)
+        try:
+            os.dup2(null, self._f.fileno())
+        finally:
+            os.close(null)
+
+class RecordingNagExt(NagExt):
+    """
+    NagExt which also records every command written to 'journal'
+    (a Journal or a path of a journal to create).
+
+    A journal can't be shared between processes: a forked child records
+    its commands to a new journal at path of parent's one with '.<pid>'
+    appended, created on its first command, and RecordingNagExt can't be
+    pickled.
+    """
+
+    def __init__(self, command_file, journal):
+        if not isinstance(journal, Journal):
+            journal = Journal(journal, 'w')
+        self.journal = journal
+        self.journal_path = journal.path
+        NagExt.__init__(self, command_file)
+
+    def __getstate__(self):
+        raise TypeError('%s can not be pickled, its journal can not be '
+                        'shared' % type(self).__name__)
+
+    def _detach(self):
+        NagExt._detach(self)
+        if self.journal is not None:
+            self.journal.detach()
+            self.journal = None
+
+    def run_at(self, timestamp, cmd, *args):
+        NagExt.run_at(self, timestamp, cmd, *args)
+        if self.journal is None:
+            self.journal = Journal('%s.%d' % (self.journal_path, self._pid),
+                                   'w')
+        self.journal.write(timestamp, cmd, format_args(args))
+
+    def close(self):
+        NagExt.close(self)
+        if self.journal is not None:
+            self.journal.close()
+
+def percentile(values, p):
+    """
+    Return 'p' percentile (0 <= p <= 100) of sorted sequence 'values'
+    """
+    if not values:
+        return 0.0
+    k = int(round((len(values) - 1) * p / 100.0))
+    return values[k]
+
+class ReplayStats(object):
+    """
+    Results of a replay: number of commands, elapsed time and write latencies
+    """
+
+    def __init__(self, count, elapsed, latencies):
+        self.count = count
+        self.elapsed = elapsed
+        self.latencies = sorted(latencies)
+
+    @property
+    def rate(self):
+        """Achieved commands per second"""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.count / self.elapsed
+
+    def percentile(self, p):
+        return percentile(self.latencies, p)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'elapsed': self.elapsed,
+            'rate': self.rate,
+            'latency_p50': self.percentile(50),
+            'latency_p90': self.percentile(90),
+            'latency_p99': self.percentile(99),
+            'latency_max': self.latencies[-1] if self.latencies else 0.0,
+        }
+
+def replay(journal, nagext, speed=1.0, rewrite_time=False):
+    """
+    Replay commands of 'journal' (a Journal or path) with 'nagext'.
+
+    'speed' scales original inter-command delays: 1 is original speed,
+    10 is ten times faster, 0 replays as fast as possible.
+    If 'rewrite_time' is true commands are stamped with current time
+    instead of recorded one.
+
+    Returns ReplayStats.
+    """
+    if not isinstance(journal, Journal):
+        journal = Journal(journal)
+    latencies = []
+    first_ts = None
+    start = time()
+    with journal:
+        for ts, cmd, str_args in journal:
+            if first_ts is None:
+                first_ts = ts
+            if speed > 0:
+                delay = start + (ts - first_ts) / speed - time()
+                if delay > 0:
+                    sleep(delay)
+            t0 = time()
+            if rewrite_time:
+                ts = t0
+            nagext.run_at(ts, cmd, str_args)
+            latencies.append(time() - t0)
+    return ReplayStats(len(latencies), time() - start, latencies)
+
+def main(argv=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+        description='Replay recorded Nagios external commands')
+    parser.add_argument('journal', help='journal recorded by RecordingNagExt')
+    parser.add_argument('command_file', help='Nagios command file')
+    parser.add_argument('-s', '--speed', type=float, default=1.0,
+                        help='speed factor, 0 means as fast as possible')
+    parser.add_argument('-n', '--now', action='store_true',
+                        help='rewrite command timestamps to current time')
+    opts = parser.parse_args(argv)
+
+    nagext = NagExt(opts.command_file)
+    try:
+        stats = replay(opts.journal, nagext, opts.speed, opts.now)
+    finally:
+        nagext.close()
+    json.dump(stats.as_dict(), sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Command file transport holding commands while Nagios restarts.
+
+    gate = RestartGate('/var/lib/nagios3/rw/nagios.cmd',
+                       lock_file='/var/run/nagios3/nagios3.pid')
+    nagext = NagExt(None, transport=gate)
+    nagext.restart_program()
+    nagext.enable_host_check('web1')  # held until Nagios reads again
+
+Nagios is followed by its command file and lock file. After a
+RESTART_PROGRAM or SHUTDOWN_PROGRAM command is written, or when writing
+finds no reader (Nagios restarted by other means), commands are kept in
+memory and send() returns at once. A thread waits for the restart to
+happen (command file reader gone or command file or lock file replaced,
+or 'settle' seconds passed) and for Nagios to read the command file
+again with its process in the lock file alive, then writes held commands
+in order. Commands sent meanwhile are queued behind them. close() waits
+up to 'close_timeout' seconds for held commands to be written and raises
+CommandsHeld if some are left.
+"""
+
+import errno
+import os
+import select
+import stat
+import threading
+
+from collections import deque
+from time import time, sleep
+
+from nagext import ExecError, PIPE_BUF, line_chunks
+
+# commands after which Nagios stops reading command file
+RESTART_COMMANDS = (b'RESTART_PROGRAM', b'SHUTDOWN_PROGRAM')
+
+class BufferFull(ExecError):
+    """
+    More than 'max_buffer' bytes held while Nagios is restarting
+    """
+    pass
+
+class CommandsHeld(ExecError):
+    """
+    Commands are still held when closing, they are kept for the next open()
+    """
+    pass
+
+def read_pid(lock_file):
+    """
+    Return pid from Nagios 'lock_file' or None
+    """
+    try:
+        with open(lock_file) as f:
+            return int(f.read().strip() or 0) or None
+    except (IOError, OSError, ValueError):
+        return None
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class RestartGate(object):
+    """
+    Writes to Nagios 'command_file', holding up to 'max_buffer' bytes of
+    commands while Nagios restarts. 'lock_file' is Nagios lock_file, if
+    given Nagios is running only while process in it is alive. 'paused'
+    tells if commands are held, 'pauses' counts restarts seen.
+    """
+
+    chunk_size = PIPE_BUF
+    poll_interval = 0.2
+    close_timeout = 10.0
+
+    def __init__(self, command_file, lock_file=None, settle=5.0,
+                 max_buffer=1 << 26):
+        self.command_file = command_file
+        self.lock_file = lock_file
+        self.settle = settle
+        self.max_buffer = max_buffer
+        self.pauses = 0
+        self._fd = None
+        self._buffer = deque()
+        self._buffered = 0
+        self._paused_at = None
+        # restart requested by a command and not seen yet
+        self._expected = False
+        # command file inode and lock file state when paused
+        self._mark = None
+        self._lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+
+    def __getstate__(self):
+        return {'command_file': self.command_file,
+                'lock_file': self.lock_file, 'settle': self.settle,
+                'max_buffer': self.max_buffer}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def paused(self):
+        return self._paused_at is not None
+
+    @property
+    def buffered(self):
+        """
+        Bytes of commands held
+        """
+        return self._buffered
+
+    def _connect(self):
+        """
+        Open command file without waiting for a reader
+
+        Raises:
+          OSError: ENXIO if Nagios doesn't read command file
+          ExecError: if command file is not a pipe
+        """
+        fd = os.open(self.command_file, os.O_WRONLY | os.O_NONBLOCK)
+        if not stat.S_ISFIFO(os.fstat(fd).st_mode):
+            os.close(fd)
+            raise ExecError('The command file "%s" is not a pipe' %
+                            self.command_file)
+        self._close_fd()
+        self._fd = fd
+
+    def _close_fd(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _state(self):
+        """
+        Return command file inode, (lock file inode, mtime, pid)
+        """
+        try:
+            ino = os.stat(self.command_file).st_ino
+        except OSError:
+            ino = None
+        lock = None
+        if self.lock_file is not None:
+            try:
+                st = os.stat(self.lock_file)
+                lock = (st.st_ino, st.st_mtime, read_pid(self.lock_file))
+            except OSError:
+                pass
+        return ino, lock
+
+    def _alive(self):
+        if self.lock_file is None:
+            return True
+        pid = read_pid(self.lock_file)
+        return pid is not None and pid_alive(pid)
+
+    def open(self):
+        """
+        Open command file, or start holding commands if Nagios doesn't
+        read it
+
+        Raises:
+          ExecError: if command file is not a pipe
+        """
+        with self._lock:
+            if self.paused or self._buffer:
+                self._start_thread()
+                return
+            try:
+                self._connect()
+            except (OSError, IOError):
+                self._pause(False)
+
+    def close(self, timeout=None):
+        """
+        Close command file, waiting up to 'timeout' seconds
+        ('close_timeout' if None) for held commands to be written
+
+        Raises:
+          CommandsHeld: if commands are still held, they are kept for the
+          next open()
+        """
+        if timeout is None:
+            timeout = self.close_timeout
+        deadline = time() + timeout
+        while self._buffer and time() < deadline:
+            sleep(min(self.poll_interval, max(deadline - time(), 0)))
+        self._stop_thread()
+        with self._lock:
+            self._close_fd()
+            if self._buffer:
+                raise CommandsHeld('%d bytes of commands still held while '
+                                   'Nagios restarts' % self._buffered)
+
+    def detach(self):
+        # in a forked child, held commands are parent's
+        self._fd = None
+        self.__init__(**self.__getstate__())
+
+    def _pause(self, expected):
+        if self._paused_at is None:
+            self.pauses += 1
+        self._paused_at = time()
+        self._expected = expected
+        self._mark = self._state()
+        # kept open, so commands Nagios didn't read yet stay in the pipe
+        # for the next reader
+        self._start_thread()
+
+    def _resume(self):
+        """
+        Return True if Nagios reads command file again and held
+        commands can be written
+        """
+        if self._expected:
+            if (time() - self._paused_at < self.settle and
+                    self._state() == self._mark):
+                try:
+                    # old process still reading
+                    os.close(os.open(self.command_file,
+                                     os.O_WRONLY | os.O_NONBLOCK))
+                    return False
+                except (OSError, IOError):
+                    pass
+            self._expected = False
+        if not self._alive():
+            return False
+        try:
+            self._connect()
+        except (OSError, IOError):
+            return False
+        self._paused_at = None
+        return True
+
+    def _write_chunk(self, chunk, block):
+        """
+        Write 'chunk', return bytes not written
+        """
+        view = memoryview(chunk)
+        while view:
+            try:
+                n = os.write(self._fd, view)
+            except (BlockingIOError, InterruptedError):
+                if not block:
+                    break
+                select.select([], [self._fd], [], self.poll_interval)
+                continue
+            except OSError as e:
+                if e.errno != errno.EPIPE:
+                    raise ExecError(str(e))
+                self._pause(False)
+                break
+            view = view[n:]
+        return view.tobytes()
+
+    def _write(self, data, block):
+        """
+        Write command lines 'data' until a restart command or until
+        Nagios stops reading, return the rest
+        """
+        split = -1
+        for cmd in RESTART_COMMANDS:
+            i = data.find(b'] ' + cmd + b';')
+            if i >= 0 and (split < 0 or i < split):
+                split = i
+        if split >= 0:
+            split = data.find(b'\n', split) + 1 or len(data)
+            data, tail = data[:split], data[split:]
+        else:
+            tail = b''
+        chunks = line_chunks(data, self.chunk_size)
+        for chunk in chunks:
+            rest = self._write_chunk(chunk, block)
+            if rest:
+                return rest + b''.join(chunks) + tail
+        if split >= 0:
+            self._pause(True)
+        return tail
+
+    def _hold(self, data):
+        if self._buffered + len(data) > self.max_buffer:
+            raise BufferFull('%d bytes held while Nagios restarts' %
+                             self._buffered)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._start_thread()
+
+    def send(self, data):
+        """
+        Write command lines 'data', or hold them while Nagios restarts
+
+        Raises:
+          BufferFull: if too many commands are held
+          ExecError: if writing fails
+        """
+        with self._lock:
+            if not self.paused and not self._buffer:
+                if self._fd is None:
+                    try:
+                        self._connect()
+                    except (OSError, IOError):
+                        self._pause(False)
+                if not self.paused:
+                    data = self._write(data, True)
+            if data:
+                self._hold(data)
+
+    def _start_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._drain,
+                                        args=(self._stop,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _stop_thread(self):
+        thread = self._thread
+        if thread is not None:
+            self._stop.set()
+            if thread is not threading.current_thread():
+                thread.join()
+            self._thread = None
+
+    def _drain(self, stop):
+        while not stop.is_set():
+            with self._lock:
+                if self.paused and not self._resume():
+                    wait = self.poll_interval
+                elif not self._buffer:
+                    self._thread = None
+                    return
+                else:
+                    data = self._buffer.popleft()
+                    self._buffered -= len(data)
+                    try:
+                        rest = self._write(data, False)
+                    except ExecError:
+                        rest = data
+                        self._pause(False)
+                    if rest:
+                        self._buffer.appendleft(rest)
+                        self._buffered += len(rest)
+                    # paused again, or pipe is full
+                    wait = self.poll_interval if self.paused else (
+                        0.01 if rest else 0)
+            if wait:
+                stop.wait(wait)
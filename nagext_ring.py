@@ -0,0 +1,255 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Shared memory ring buffer of external commands for multi-process producers.
+
+Many producer processes format commands with RingNagExt (same methods as
+NagExt) into a CommandRing in shared memory, a single RingWriter process
+drains it to Nagios command file in large writes:
+
+    ring = CommandRing(1 << 24)
+    writer = RingWriter(ring, '/var/lib/nagios3/rw/nagios.cmd')
+    writer.start()
+    pool = multiprocessing.Pool(8, initializer=init_worker, initargs=(ring,))
+    ...
+    # in workers
+    nagext = RingNagExt(ring)
+    nagext.process_service_check_result(host, service, 0, 'OK')
+    ...
+    writer.stop()
+    ring.unlink()
+
+CommandRing must reach producers on process creation (Process arguments
+or Pool initializer) because its lock can't be pickled otherwise.
+"""
+
+import multiprocessing
+import struct
+
+from multiprocessing import shared_memory
+from time import time, sleep
+
+from nagext import NagExt, ExecError, PIPE_BUF, line_chunks
+
+# write position, read position: total bytes ever written and read
+_HEADER = struct.Struct('QQ')
+
+class RingFull(ExecError):
+    """
+    Ring stays full longer than put() timeout
+    """
+    pass
+
+class CommandRing(object):
+    """
+    Multi-producer single-consumer byte ring in shared memory.
+
+    Producers put whole command lines under a lock; the consumer copies
+    data between read and write positions without holding the lock since
+    producers never touch that region.
+    """
+
+    def __init__(self, size=1 << 22):
+        self.size = size
+        self._shm = shared_memory.SharedMemory(create=True,
+                                               size=_HEADER.size + size)
+        _HEADER.pack_into(self._shm.buf, 0, 0, 0)
+        self.name = self._shm.name
+        self._buf = self._shm.buf[_HEADER.size:_HEADER.size + size]
+        self._lock = multiprocessing.Lock()
+        self._ready = multiprocessing.Event()
+
+    def __getstate__(self):
+        return (self.size, self.name, self._lock, self._ready)
+
+    def __setstate__(self, state):
+        self.size, self.name, self._lock, self._ready = state
+        self._shm = shared_memory.SharedMemory(name=self.name)
+        self._buf = self._shm.buf[_HEADER.size:_HEADER.size + self.size]
+
+    def _positions(self):
+        return _HEADER.unpack_from(self._shm.buf, 0)
+
+    def __len__(self):
+        """
+        Bytes waiting to be read
+        """
+        with self._lock:
+            w, r = self._positions()
+        return w - r
+
+    def put(self, data, timeout=None):
+        """
+        Append 'data' (bytes of whole command lines) to the ring, waiting
+        up to 'timeout' seconds (forever if None) for free space. Data
+        larger than the ring is put in pieces of whole lines, other
+        producers may put theirs in between.
+
+        Raises:
+          RingFull: if there is no space for 'data' in time or a line
+          is larger than the ring
+        """
+        deadline = None if timeout is None else time() + timeout
+        for chunk in line_chunks(data, self.size):
+            if len(chunk) > self.size:
+                raise RingFull('Line of %d bytes never fits into ring of %d '
+                               'bytes' % (len(chunk), self.size))
+            self._put(chunk, deadline)
+
+    def _put(self, data, deadline):
+        n = len(data)
+        delay = 0.0001
+        while True:
+            with self._lock:
+                w, r = self._positions()
+                if self.size - (w - r) >= n:
+                    self._copy_in(w % self.size, data)
+                    _HEADER.pack_into(self._shm.buf, 0, w + n, r)
+                    break
+            if deadline is not None and time() >= deadline:
+                raise RingFull('No space for %d bytes in ring' % n)
+            sleep(delay)
+            delay = min(delay * 2, 0.01)
+        self._ready.set()
+
+    def _copy_in(self, pos, data):
+        first = min(len(data), self.size - pos)
+        self._buf[pos:pos + first] = data[:first]
+        if first < len(data):
+            self._buf[:len(data) - first] = data[first:]
+
+    def get(self, max_bytes):
+        """
+        Remove and return up to 'max_bytes' bytes from the ring,
+        b'' if it is empty. Only one consumer may call get().
+        """
+        with self._lock:
+            w, r = self._positions()
+        n = min(w - r, max_bytes)
+        if not n:
+            return b''
+        pos = r % self.size
+        first = min(n, self.size - pos)
+        data = bytes(self._buf[pos:pos + first])
+        if first < n:
+            data += bytes(self._buf[:n - first])
+        with self._lock:
+            w, _ = self._positions()
+            _HEADER.pack_into(self._shm.buf, 0, w, r + n)
+        return data
+
+    def wait(self, timeout):
+        """
+        Wait up to 'timeout' seconds for data put after last wait()
+        """
+        self._ready.wait(timeout)
+        self._ready.clear()
+
+    def close(self):
+        self._buf.release()
+        self._shm.close()
+
+    def unlink(self):
+        """
+        Destroy shared memory segment, call once after all users closed it
+        """
+        self._shm.unlink()
+
+class RingNagExt(NagExt):
+    """
+    NagExt putting commands into CommandRing 'ring' instead of command file.
+
+    Every flush (each command, or each batch() block) is one put() so
+    batched commands stay together, unless they don't fit into the ring
+    at once. 'timeout' is passed to put().
+    """
+
+    def __init__(self, ring, timeout=None, metrics=None):
+        self._setup(None, metrics, False, None)
+        self.ring = ring
+        self.timeout = timeout
+
+    def __getstate__(self):
+        return {'ring': self.ring, 'timeout': self.timeout}
+
+    def __setstate__(self, state):
+        self._setup(None, None, False, None)
+        self.ring = state['ring']
+        self.timeout = state['timeout']
+
+    def open(self, pipe_size=None):
+        pass
+
+    def write_data(self, data):
+        if self.metrics is not None:
+            self.metrics.inc('bytes', len(data))
+            t0 = time()
+        self.ring.put(data, self.timeout)
+        if self.metrics is not None:
+            self.metrics.observe('write_latency', time() - t0)
+
+def _drain(ring, command_file, chunk_size, read_size, stop, nagext_kwargs):
+    nagext = NagExt(command_file, **nagext_kwargs)
+    nagext.chunk_size = chunk_size
+    tail = b''
+    while True:
+        stopping = stop.is_set()
+        data = ring.get(read_size)
+        if data:
+            # keep incomplete line for the next round
+            data = tail + data
+            nl = data.rfind(b'\n') + 1
+            tail = data[nl:]
+            if nl:
+                nagext.write_data(data[:nl])
+            continue
+        if stopping:
+            break
+        ring.wait(0.1)
+    nagext.close()
+    ring.close()
+
+class RingWriter(object):
+    """
+    Process draining CommandRing 'ring' into Nagios 'command_file',
+    taking up to 'read_size' bytes from the ring at once and writing them
+    in chunks of up to 'chunk_size' bytes. Writes of more than PIPE_BUF
+    bytes are not atomic, so with a larger 'chunk_size' other writers of
+    the command file (cmd.cgi, other NagExt) may interleave mid-line.
+    Extra keyword arguments are passed to NagExt of the writer process.
+    """
+
+    def __init__(self, ring, command_file, chunk_size=PIPE_BUF,
+                 read_size=1 << 16, **kwargs):
+        self._stop = multiprocessing.Event()
+        self._proc = multiprocessing.Process(
+            target=_drain,
+            args=(ring, command_file, chunk_size, read_size, self._stop,
+                  kwargs))
+        self._proc.daemon = True
+
+    def start(self):
+        self._proc.start()
+
+    def stop(self):
+        """
+        Write everything left in the ring and stop the writer process
+        """
+        self._stop.set()
+        self._proc.join()
@@ -0,0 +1,318 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Persistent scheduler of commands to run later.
+
+    scheduler = Scheduler(nagext, '/var/lib/nagext/deferred.db')
+    scheduler.start()
+    scheduler.at(tomorrow_6am).enable_host_notifications('web1')
+    scheduler.schedule(time() + 4 * 3600,
+                       'remove_svc_acknowledgement', 'web1', 'HTTP')
+
+Commands are kept in a SQLite table indexed by due time, so they survive
+restarts and both adding and taking the earliest command are O(log n).
+The scheduler thread sleeps until the earliest due time, or until an
+earlier command is added, and runs all due commands in NagExt batches
+of 'batch_size'. A command is removed only after its batch was written,
+so a crash in between runs it again. Commands refused by a Validator or
+by Nagios (errors in 'rejected') are moved to the failed table, see
+failures(); if a Validator refuses a command, commands of its batch are
+run one by one to find it. If writing fails otherwise, or anything else
+goes wrong, the error is logged and the batch is retried after
+'retry_interval' seconds. Once started, 'nagext' is used from the
+scheduler thread, so it shouldn't be shared with other threads.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+
+from collections import Counter
+from time import time
+
+from nagext import commands, format_args
+from nagext_objects import ValidationError
+from nagext_qh import CommandRejected
+
+log = logging.getLogger(__name__)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS deferred ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, due REAL NOT NULL, '
+    'command TEXT NOT NULL, args TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS deferred_due ON deferred (due, id)',
+    'CREATE TABLE IF NOT EXISTS failed ('
+    'id INTEGER PRIMARY KEY, due REAL NOT NULL, command TEXT NOT NULL, '
+    'args TEXT NOT NULL, failed REAL NOT NULL, error TEXT NOT NULL)',
+)
+
+def _timestamp(due):
+    # datetime or seconds since epoch
+    if hasattr(due, 'timestamp'):
+        return due.timestamp()
+    return float(due)
+
+class _At(object):
+    """
+    Generated NagExt methods scheduling their command at 'due'
+    """
+
+    def __init__(self, scheduler, due):
+        self._scheduler = scheduler
+        self._due = due
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        def schedule(*args):
+            return self._scheduler.schedule(self._due, name, *args)
+        return schedule
+
+class Scheduler(object):
+    """
+    Runs commands through 'nagext' when they are due, keeping them in
+    SQLite database 'path'
+    """
+
+    retry_interval = 10.0
+    # errors of commands never to be retried
+    rejected = (ValidationError, CommandRejected)
+    # wall clock may be changed while sleeping
+    max_sleep = 300.0
+
+    def __init__(self, nagext, path, batch_size=500):
+        self.nagext = nagext
+        self.path = path
+        self.batch_size = batch_size
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # survives crashes of the process, the last commits may be lost
+        # with the whole machine
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._db:
+            for statement in SCHEMA:
+                self._db.execute(statement)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = None
+        self._thread = None
+
+    def close(self):
+        self.stop()
+        self._db.close()
+
+    def schedule(self, due, cmd, *args):
+        """
+        Run generated NagExt command 'cmd' (method name or command id)
+        with 'args' at 'due' (datetime or seconds since epoch),
+        returns id of the entry
+
+        Raises:
+          ValueError: if 'cmd' is not a generated command or gets wrong
+          number of arguments
+        """
+        cmd = cmd.upper()
+        names = commands().get(cmd)
+        if names is None:
+            raise ValueError('Unknown command %s' % cmd)
+        if len(args) != len(names):
+            raise ValueError('%s takes %d arguments (%s), %d given' % (
+                cmd, len(names), ', '.join(names), len(args)))
+        args = [a.decode('utf-8') if isinstance(a, bytes) else a
+                for a in args]
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'INSERT INTO deferred (due, command, args) VALUES (?, ?, ?)',
+                (_timestamp(due), cmd, json.dumps(args, default=str)))
+        # scheduler thread may sleep past the new command
+        self._wake.set()
+        return cursor.lastrowid
+
+    def at(self, due):
+        """
+        Return object with generated NagExt methods scheduling their
+        commands at 'due'
+        """
+        return _At(self, due)
+
+    def cancel(self, entry_id):
+        """
+        Remove scheduled command, returns False if there was none
+        """
+        with self._lock, self._db:
+            cursor = self._db.execute('DELETE FROM deferred WHERE id = ?',
+                                      (entry_id,))
+        return cursor.rowcount > 0
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM deferred'
+                                    ).fetchone()[0]
+
+    def pending(self, until=None):
+        """
+        Return list of (id, due, command, args) due before 'until'
+        (all if None), earliest first
+        """
+        if until is None:
+            until = float('inf')
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id, due, command, args FROM deferred WHERE due <= ? '
+                'ORDER BY due, id', (_timestamp(until),)).fetchall()
+        return [(i, due, cmd, tuple(json.loads(args)))
+                for i, due, cmd, args in rows]
+
+    def next_due(self):
+        """
+        Return due time of the earliest command or None
+        """
+        with self._lock:
+            return self._db.execute('SELECT MIN(due) FROM deferred'
+                                    ).fetchone()[0]
+
+    def failures(self):
+        """
+        Return list of (id, due, command, args, failed, error) of commands
+        refused when run, oldest first
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id, due, command, args, failed, error FROM failed '
+                'ORDER BY failed, id').fetchall()
+        return [(i, due, cmd, tuple(json.loads(args)), failed, error)
+                for i, due, cmd, args, failed, error in rows]
+
+    def fire(self, now=None):
+        """
+        Run commands due by 'now' in NagExt batches of 'batch_size',
+        returns number of commands written
+
+        Raises:
+          ExecError: if writing fails, the batch stays scheduled
+        """
+        if now is None:
+            now = time()
+        nagext = self.nagext
+        fired = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    'SELECT id, due, command, args FROM deferred '
+                    'WHERE due <= ? ORDER BY due, id LIMIT ?',
+                    (now, self.batch_size)).fetchall()
+            if not rows:
+                return fired
+            try:
+                with nagext.batch():
+                    for _, _, cmd, args in rows:
+                        nagext.run(cmd, *json.loads(args))
+            except self.rejected as e:
+                if not isinstance(e, CommandRejected):
+                    # raised inside the batch, nothing was written
+                    fired += self._fire_each(rows)
+                    continue
+                # batch was written, Nagios refused only some commands
+                refused = Counter(line.partition('] ')[2]
+                                  for line, _, _ in e.replies)
+                done = []
+                failed = []
+                for row in rows:
+                    entry_id, due, cmd, args = row
+                    line = '%s;%s' % (cmd, format_args(json.loads(args)))
+                    if refused[line]:
+                        refused[line] -= 1
+                        failed.append(row + (time(), str(e)))
+                    else:
+                        done.append((entry_id,))
+                self._settle(done, failed)
+                fired += len(done)
+                continue
+            self._settle([row[:1] for row in rows], [])
+            fired += len(rows)
+
+    def _fire_each(self, rows):
+        """
+        Run commands of 'rows' one by one, returns number of commands
+        written
+        """
+        nagext = self.nagext
+        done = []
+        failed = []
+        try:
+            for row in rows:
+                _, _, cmd, args = row
+                try:
+                    nagext.run(cmd, *json.loads(args))
+                    # adaptive NagExt would write it later
+                    nagext.flush()
+                except self.rejected as e:
+                    failed.append(row + (time(), str(e)))
+                else:
+                    done.append(row[:1])
+        finally:
+            self._settle(done, failed)
+        return len(done)
+
+    def _settle(self, done, failed):
+        """
+        Remove commands 'done' (ids) and move 'failed' (rows with failure
+        time and error) to failed table
+        """
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO failed (id, due, command, args, '
+                'failed, error) VALUES (?, ?, ?, ?, ?, ?)', failed)
+            self._db.executemany('DELETE FROM deferred WHERE id = ?',
+                                 done + [f[:1] for f in failed])
+
+    def start(self):
+        """
+        Run due commands in a thread
+        """
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop,
+                                        args=(self._stop,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self, stop):
+        while not stop.is_set():
+            # commands added from now on wake us up
+            self._wake.clear()
+            try:
+                self.fire()
+            except Exception:
+                log.exception('Running scheduled commands failed, retrying '
+                              'in %s seconds', self.retry_interval)
+                stop.wait(self.retry_interval)
+                continue
+            due = self.next_due()
+            timeout = self.max_sleep
+            if due is not None:
+                timeout = min(max(due - time(), 0), timeout)
+            self._wake.wait(timeout)
@@ -0,0 +1,723 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Simulated Nagios command consumer.
+
+Simulator reads external commands from a command file (or takes them with
+Simulator.apply) and applies them to an in-memory State of hosts, services,
+downtimes, comments and notification/check flags, so automation can be
+tested and load tested without Nagios. Processing cost of every command
+name is measured.
+
+QueryHandlerServer and LivestatusServer put a Simulator behind stand-ins
+of the Nagios 4 query handler and Livestatus sockets, for tests of socket
+transports.
+"""
+
+import os
+import select
+import socket
+import threading
+
+from time import time, perf_counter
+
+class SimulatorError(Exception):
+    """
+    Errors while applying command to simulated state
+    """
+    pass
+
+class Host(object):
+    __slots__ = ('name', 'state', 'plugin_output', 'last_check', 'parents',
+                 'notifications_enabled', 'active_checks_enabled',
+                 'passive_checks_enabled', 'event_handler_enabled',
+                 'flap_detection_enabled', 'acknowledged', 'check_interval',
+                 'custom', 'services')
+
+    def __init__(self, name, parents=()):
+        self.name = name
+        self.state = 0
+        self.plugin_output = ''
+        self.last_check = 0
+        self.parents = set(parents)
+        self.notifications_enabled = True
+        self.active_checks_enabled = True
+        self.passive_checks_enabled = True
+        self.event_handler_enabled = True
+        self.flap_detection_enabled = True
+        self.acknowledged = False
+        self.check_interval = None
+        self.custom = {}
+        self.services = {}
+
+    def __repr__(self):
+        return '<Host %s>' % self.name
+
+class Service(object):
+    __slots__ = ('host_name', 'description', 'state', 'plugin_output',
+                 'last_check', 'notifications_enabled',
+                 'active_checks_enabled', 'passive_checks_enabled',
+                 'event_handler_enabled', 'flap_detection_enabled',
+                 'acknowledged', 'check_interval', 'custom')
+
+    def __init__(self, host_name, description):
+        self.host_name = host_name
+        self.description = description
+        self.state = 0
+        self.plugin_output = ''
+        self.last_check = 0
+        self.notifications_enabled = True
+        self.active_checks_enabled = True
+        self.passive_checks_enabled = True
+        self.event_handler_enabled = True
+        self.flap_detection_enabled = True
+        self.acknowledged = False
+        self.check_interval = None
+        self.custom = {}
+
+    def __repr__(self):
+        return '<Service %s;%s>' % (self.host_name, self.description)
+
+class Downtime(object):
+    __slots__ = ('downtime_id', 'host_name', 'service_description',
+                 'start_time', 'end_time', 'fixed', 'trigger_id', 'duration',
+                 'author', 'comment')
+
+    def __init__(self, downtime_id, host_name, service_description,
+                 start_time, end_time, fixed, trigger_id, duration, author,
+                 comment):
+        self.downtime_id = downtime_id
+        self.host_name = host_name
+        self.service_description = service_description
+        self.start_time = start_time
+        self.end_time = end_time
+        self.fixed = fixed
+        self.trigger_id = trigger_id
+        self.duration = duration
+        self.author = author
+        self.comment = comment
+
+class Comment(object):
+    __slots__ = ('comment_id', 'host_name', 'service_description',
+                 'persistent', 'author', 'comment')
+
+    def __init__(self, comment_id, host_name, service_description,
+                 persistent, author, comment):
+        self.comment_id = comment_id
+        self.host_name = host_name
+        self.service_description = service_description
+        self.persistent = persistent
+        self.author = author
+        self.comment = comment
+
+class State(object):
+    """
+    In-memory model of Nagios objects and their runtime state.
+
+    With 'autocreate' hosts and services referenced by commands are created
+    on first use, otherwise commands for unknown objects raise SimulatorError.
+    """
+
+    def __init__(self, autocreate=True):
+        self.autocreate = autocreate
+        self.hosts = {}
+        self.hostgroups = {}
+        self.servicegroups = {}
+        self.child_hosts = {}
+        self.downtimes = {}
+        self.comments = {}
+        self.program = {
+            'enable_notifications': True,
+            'execute_host_checks': True,
+            'execute_service_checks': True,
+            'accept_passive_host_checks': True,
+            'accept_passive_service_checks': True,
+            'enable_event_handlers': True,
+            'enable_flap_detection': True,
+            'process_performance_data': True,
+            'running': True,
+        }
+        self._next_downtime_id = 1
+        self._next_comment_id = 1
+
+    def add_host(self, name, parents=(), hostgroups=()):
+        host = self.hosts.get(name)
+        if host is None:
+            host = self.hosts[name] = Host(name, parents)
+        else:
+            host.parents.update(parents)
+        for p in parents:
+            self.child_hosts.setdefault(p, set()).add(name)
+        for g in hostgroups:
+            self.hostgroups.setdefault(g, set()).add(name)
+        return host
+
+    def add_service(self, host_name, description, servicegroups=()):
+        host = self.add_host(host_name)
+        svc = host.services.get(description)
+        if svc is None:
+            svc = host.services[description] = Service(host_name, description)
+        for g in servicegroups:
+            self.servicegroups.setdefault(g, set()).add((host_name, description))
+        return svc
+
+    def host(self, name):
+        host = self.hosts.get(name)
+        if host is None:
+            if not self.autocreate:
+                raise SimulatorError('Unknown host "%s"' % name)
+            host = self.add_host(name)
+        return host
+
+    def service(self, host_name, description):
+        host = self.host(host_name)
+        svc = host.services.get(description)
+        if svc is None:
+            if not self.autocreate:
+                raise SimulatorError('Unknown service "%s;%s"' %
+                                     (host_name, description))
+            svc = self.add_service(host_name, description)
+        return svc
+
+    def hostgroup(self, name):
+        try:
+            return [self.hosts[h] for h in sorted(self.hostgroups[name])]
+        except KeyError:
+            raise SimulatorError('Unknown hostgroup "%s"' % name)
+
+    def servicegroup(self, name):
+        try:
+            return [self.hosts[h].services[s]
+                    for h, s in sorted(self.servicegroups[name])]
+        except KeyError:
+            raise SimulatorError('Unknown servicegroup "%s"' % name)
+
+    def children(self, name):
+        return [self.hosts[h] for h in sorted(self.child_hosts.get(name, ()))]
+
+    def add_downtime(self, host_name, service_description, args):
+        start, end, fixed, trigger_id, duration, author, comment = args
+        dt = Downtime(self._next_downtime_id, host_name, service_description,
+                      int(start), int(end), bool(int(fixed)), int(trigger_id),
+                      int(duration), author, comment)
+        self.downtimes[dt.downtime_id] = dt
+        self._next_downtime_id += 1
+        return dt
+
+    def add_comment(self, host_name, service_description, persistent,
+                    author, comment):
+        c = Comment(self._next_comment_id, host_name, service_description,
+                    bool(int(persistent)), author, comment)
+        self.comments[c.comment_id] = c
+        self._next_comment_id += 1
+        return c
+
+    def host_downtimes(self, host_name):
+        return [d for d in self.downtimes.values()
+                if d.host_name == host_name and d.service_description is None]
+
+    def service_downtimes(self, host_name, description):
+        return [d for d in self.downtimes.values()
+                if d.host_name == host_name and
+                d.service_description == description]
+
+# commands switching a flag: name without ENABLE_/DISABLE_ -> (scope, flag)
+_FLAGS = {
+    'HOST_NOTIFICATIONS': ('host', 'notifications_enabled'),
+    'SVC_NOTIFICATIONS': ('svc', 'notifications_enabled'),
+    'HOST_SVC_NOTIFICATIONS': ('host_svcs', 'notifications_enabled'),
+    'HOST_CHECK': ('host', 'active_checks_enabled'),
+    'SVC_CHECK': ('svc', 'active_checks_enabled'),
+    'HOST_SVC_CHECKS': ('host_svcs', 'active_checks_enabled'),
+    'PASSIVE_HOST_CHECKS': ('host', 'passive_checks_enabled'),
+    'PASSIVE_SVC_CHECKS': ('svc', 'passive_checks_enabled'),
+    'HOST_EVENT_HANDLER': ('host', 'event_handler_enabled'),
+    'SVC_EVENT_HANDLER': ('svc', 'event_handler_enabled'),
+    'HOST_FLAP_DETECTION': ('host', 'flap_detection_enabled'),
+    'SVC_FLAP_DETECTION': ('svc', 'flap_detection_enabled'),
+    'HOSTGROUP_HOST_NOTIFICATIONS': ('hostgroup_hosts', 'notifications_enabled'),
+    'HOSTGROUP_SVC_NOTIFICATIONS': ('hostgroup_svcs', 'notifications_enabled'),
+    'HOSTGROUP_HOST_CHECKS': ('hostgroup_hosts', 'active_checks_enabled'),
+    'HOSTGROUP_SVC_CHECKS': ('hostgroup_svcs', 'active_checks_enabled'),
+    'HOSTGROUP_PASSIVE_HOST_CHECKS': ('hostgroup_hosts', 'passive_checks_enabled'),
+    'HOSTGROUP_PASSIVE_SVC_CHECKS': ('hostgroup_svcs', 'passive_checks_enabled'),
+    'SERVICEGROUP_HOST_NOTIFICATIONS': ('servicegroup_hosts', 'notifications_enabled'),
+    'SERVICEGROUP_SVC_NOTIFICATIONS': ('servicegroup_svcs', 'notifications_enabled'),
+    'SERVICEGROUP_HOST_CHECKS': ('servicegroup_hosts', 'active_checks_enabled'),
+    'SERVICEGROUP_SVC_CHECKS': ('servicegroup_svcs', 'active_checks_enabled'),
+    'SERVICEGROUP_PASSIVE_HOST_CHECKS': ('servicegroup_hosts', 'passive_checks_enabled'),
+    'SERVICEGROUP_PASSIVE_SVC_CHECKS': ('servicegroup_svcs', 'passive_checks_enabled'),
+    'NOTIFICATIONS': ('program', 'enable_notifications'),
+    'EVENT_HANDLERS': ('program', 'enable_event_handlers'),
+    'FLAP_DETECTION': ('program', 'enable_flap_detection'),
+    'PERFORMANCE_DATA': ('program', 'process_performance_data'),
+}
+
+# program wide START_/STOP_ commands
+_PROGRAM_FLAGS = {
+    'EXECUTING_HOST_CHECKS': 'execute_host_checks',
+    'EXECUTING_SVC_CHECKS': 'execute_service_checks',
+    'ACCEPTING_PASSIVE_HOST_CHECKS': 'accept_passive_host_checks',
+    'ACCEPTING_PASSIVE_SVC_CHECKS': 'accept_passive_service_checks',
+}
+
+# number of arguments of commands with own handlers
+_NARGS = {
+    'PROCESS_HOST_CHECK_RESULT': 3,
+    'PROCESS_SERVICE_CHECK_RESULT': 4,
+    'SCHEDULE_HOST_DOWNTIME': 8,
+    'SCHEDULE_SVC_DOWNTIME': 9,
+    'SCHEDULE_HOST_SVC_DOWNTIME': 8,
+    'SCHEDULE_HOSTGROUP_HOST_DOWNTIME': 8,
+    'SCHEDULE_HOSTGROUP_SVC_DOWNTIME': 8,
+    'SCHEDULE_SERVICEGROUP_HOST_DOWNTIME': 8,
+    'SCHEDULE_SERVICEGROUP_SVC_DOWNTIME': 8,
+    'SCHEDULE_AND_PROPAGATE_HOST_DOWNTIME': 8,
+    'SCHEDULE_AND_PROPAGATE_TRIGGERED_HOST_DOWNTIME': 8,
+    'DEL_HOST_DOWNTIME': 1,
+    'DEL_SVC_DOWNTIME': 1,
+    'ADD_HOST_COMMENT': 4,
+    'ADD_SVC_COMMENT': 5,
+    'DEL_HOST_COMMENT': 1,
+    'DEL_SVC_COMMENT': 1,
+    'DEL_ALL_HOST_COMMENTS': 1,
+    'DEL_ALL_SVC_COMMENTS': 2,
+    'ACKNOWLEDGE_HOST_PROBLEM': 6,
+    'ACKNOWLEDGE_SVC_PROBLEM': 7,
+    'REMOVE_HOST_ACKNOWLEDGEMENT': 1,
+    'REMOVE_SVC_ACKNOWLEDGEMENT': 2,
+    'CHANGE_CUSTOM_HOST_VAR': 3,
+    'CHANGE_CUSTOM_SVC_VAR': 4,
+    'CHANGE_NORMAL_HOST_CHECK_INTERVAL': 2,
+    'CHANGE_NORMAL_SVC_CHECK_INTERVAL': 3,
+    'RESTART_PROGRAM': 0,
+    'SHUTDOWN_PROGRAM': 0,
+}
+
+class Simulator(object):
+    """
+    Applies external commands to a State.
+
+    Processing cost per command name is collected in 'stats' as
+    command_id -> [count, total_seconds]; commands the simulator doesn't
+    know are counted in 'ignored', commands failed to apply in 'errors'.
+    """
+
+    def __init__(self, state=None):
+        if state is None:
+            state = State()
+        self.state = state
+        self.stats = {}
+        self.ignored = 0
+        self.errors = []
+        self.processed = 0
+        self._lock = threading.Condition()
+        self._thread = None
+        self._stop = None
+        self._fd = None
+
+    def apply(self, line):
+        """
+        Apply one command line '[time] command_id;command_arguments',
+        returns True if applied
+        """
+        t0 = perf_counter()
+        line = line.rstrip('\n')
+        cmd = ''
+        with self._lock:
+            ok = False
+            try:
+                if line.startswith('['):
+                    line = line[line.index(']') + 1:].lstrip()
+                cmd, _, str_args = line.partition(';')
+                ok = self._dispatch(cmd, str_args)
+                if not ok:
+                    self.ignored += 1
+            except (SimulatorError, ValueError, IndexError, KeyError) as e:
+                # bad input must not stop the reader
+                self.errors.append((line, str(e)))
+            s = self.stats.get(cmd)
+            if s is None:
+                s = self.stats[cmd] = [0, 0.0]
+            s[0] += 1
+            s[1] += perf_counter() - t0
+            self.processed += 1
+            self._lock.notify_all()
+        return bool(ok)
+
+    def costs(self):
+        """
+        Return dict command_id -> (count, mean seconds per command)
+        """
+        with self._lock:
+            return dict((cmd, (n, total / n))
+                        for cmd, (n, total) in self.stats.items())
+
+    def _dispatch(self, cmd, str_args):
+        if cmd.startswith('ENABLE_') or cmd.startswith('DISABLE_'):
+            value, _, name = cmd.partition('_')
+            flag = _FLAGS.get(name)
+            if flag is None:
+                return False
+            self._set_flag(flag[0], flag[1], value == 'ENABLE', str_args)
+            return True
+        if cmd.startswith('START_') or cmd.startswith('STOP_'):
+            value, _, name = cmd.partition('_')
+            flag = _PROGRAM_FLAGS.get(name)
+            if flag is None:
+                return False
+            self.state.program[flag] = value == 'START'
+            return True
+        nargs = _NARGS.get(cmd)
+        if nargs is None:
+            return False
+        args = str_args.split(';', nargs - 1) if nargs else []
+        if len(args) != nargs:
+            raise SimulatorError('%s takes %d arguments, %d given' %
+                                 (cmd, nargs, len(args)))
+        getattr(self, '_' + cmd.lower())(*args)
+        return True
+
+    def _set_flag(self, scope, flag, value, str_args):
+        state = self.state
+        args = str_args.split(';')
+        if scope == 'program':
+            state.program[flag] = value
+            return
+        if scope == 'host':
+            objs = [state.host(args[0])]
+        elif scope == 'svc':
+            objs = [state.service(args[0], args[1])]
+        elif scope == 'host_svcs':
+            objs = state.host(args[0]).services.values()
+        elif scope == 'hostgroup_hosts':
+            objs = state.hostgroup(args[0])
+        elif scope == 'hostgroup_svcs':
+            objs = [s for h in state.hostgroup(args[0])
+                    for s in h.services.values()]
+        elif scope == 'servicegroup_hosts':
+            objs = set(state.hosts[s.host_name]
+                       for s in state.servicegroup(args[0]))
+        else:
+            objs = state.servicegroup(args[0])
+        for o in objs:
+            setattr(o, flag, value)
+
+    def _process_host_check_result(self, host_name, status_code, output):
+        host = self.state.host(host_name)
+        host.state = int(status_code)
+        host.plugin_output = output
+        host.last_check = time()
+
+    def _process_service_check_result(self, host_name, description,
+                                      return_code, output):
+        svc = self.state.service(host_name, description)
+        svc.state = int(return_code)
+        svc.plugin_output = output
+        svc.last_check = time()
+
+    def _schedule_host_downtime(self, host_name, *args):
+        return self.state.add_downtime(self.state.host(host_name).name, None,
+                                       args)
+
+    def _schedule_svc_downtime(self, host_name, description, *args):
+        svc = self.state.service(host_name, description)
+        self.state.add_downtime(svc.host_name, svc.description, args)
+
+    def _schedule_host_svc_downtime(self, host_name, *args):
+        for svc in self.state.host(host_name).services.values():
+            self.state.add_downtime(svc.host_name, svc.description, args)
+
+    def _schedule_hostgroup_host_downtime(self, hostgroup_name, *args):
+        for host in self.state.hostgroup(hostgroup_name):
+            self.state.add_downtime(host.name, None, args)
+
+    def _schedule_hostgroup_svc_downtime(self, hostgroup_name, *args):
+        for host in self.state.hostgroup(hostgroup_name):
+            for svc in host.services.values():
+                self.state.add_downtime(svc.host_name, svc.description, args)
+
+    def _schedule_servicegroup_host_downtime(self, servicegroup_name, *args):
+        hosts = set(s.host_name
+                    for s in self.state.servicegroup(servicegroup_name))
+        for host_name in sorted(hosts):
+            self.state.add_downtime(host_name, None, args)
+
+    def _schedule_servicegroup_svc_downtime(self, servicegroup_name, *args):
+        for svc in self.state.servicegroup(servicegroup_name):
+            self.state.add_downtime(svc.host_name, svc.description, args)
+
+    def _propagate_downtime(self, host_name, args, triggered):
+        root = self._schedule_host_downtime(host_name, *args)
+        child_args = list(args)
+        if triggered:
+            child_args[3] = str(root.downtime_id)
+        seen = set([host_name])
+        todo = [host_name]
+        while todo:
+            for child in self.state.children(todo.pop()):
+                if child.name not in seen:
+                    seen.add(child.name)
+                    todo.append(child.name)
+                    self.state.add_downtime(child.name, None, child_args)
+
+    def _schedule_and_propagate_host_downtime(self, host_name, *args):
+        self._propagate_downtime(host_name, args, False)
+
+    def _schedule_and_propagate_triggered_host_downtime(self, host_name, *args):
+        self._propagate_downtime(host_name, args, True)
+
+    def _del_host_downtime(self, downtime_id):
+        self.state.downtimes.pop(int(downtime_id), None)
+
+    _del_svc_downtime = _del_host_downtime
+
+    def _add_host_comment(self, host_name, persistent, author, comment):
+        self.state.add_comment(self.state.host(host_name).name, None,
+                               persistent, author, comment)
+
+    def _add_svc_comment(self, host_name, description, persistent, author,
+                         comment):
+        svc = self.state.service(host_name, description)
+        self.state.add_comment(svc.host_name, svc.description, persistent,
+                               author, comment)
+
+    def _del_host_comment(self, comment_id):
+        self.state.comments.pop(int(comment_id), None)
+
+    _del_svc_comment = _del_host_comment
+
+    def _del_all_host_comments(self, host_name):
+        for c in list(self.state.comments.values()):
+            if c.host_name == host_name and c.service_description is None:
+                del self.state.comments[c.comment_id]
+
+    def _del_all_svc_comments(self, host_name, description):
+        for c in list(self.state.comments.values()):
+            if (c.host_name == host_name and
+                    c.service_description == description):
+                del self.state.comments[c.comment_id]
+
+    def _acknowledge_host_problem(self, host_name, sticky, notify, persistent,
+                                  author, comment):
+        self.state.host(host_name).acknowledged = True
+        self._add_host_comment(host_name, persistent, author, comment)
+
+    def _acknowledge_svc_problem(self, host_name, description, sticky, notify,
+                                 persistent, author, comment):
+        self.state.service(host_name, description).acknowledged = True
+        self._add_svc_comment(host_name, description, persistent, author,
+                              comment)
+
+    def _remove_host_acknowledgement(self, host_name):
+        self.state.host(host_name).acknowledged = False
+
+    def _remove_svc_acknowledgement(self, host_name, description):
+        self.state.service(host_name, description).acknowledged = False
+
+    def _change_custom_host_var(self, host_name, varname, varvalue):
+        self.state.host(host_name).custom[varname.upper()] = varvalue
+
+    def _change_custom_svc_var(self, host_name, description, varname,
+                               varvalue):
+        svc = self.state.service(host_name, description)
+        svc.custom[varname.upper()] = varvalue
+
+    def _change_normal_host_check_interval(self, host_name, check_interval):
+        self.state.host(host_name).check_interval = float(check_interval)
+
+    def _change_normal_svc_check_interval(self, host_name, description,
+                                          check_interval):
+        svc = self.state.service(host_name, description)
+        svc.check_interval = float(check_interval)
+
+    def _restart_program(self):
+        self.state.program['running'] = True
+
+    def _shutdown_program(self):
+        self.state.program['running'] = False
+
+    def start(self, command_file):
+        """
+        Start reading commands from fifo 'command_file' in a thread
+        """
+        # opened for reading and writing so that the fifo never reports
+        # EOF when writers close it, just like Nagios keeps it open
+        self._fd = os.open(command_file, os.O_RDWR | os.O_NONBLOCK)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _read_loop(self):
+        buf = b''
+        while not self._stop.is_set():
+            if not select.select([self._fd], [], [], 0.05)[0]:
+                continue
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                continue
+            lines = (buf + data).split(b'\n')
+            buf = lines.pop()
+            for line in lines:
+                self.apply(line.decode('utf-8', 'replace'))
+
+    def stop(self):
+        """
+        Stop reading commands from command file
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            os.close(self._fd)
+            self._thread = self._fd = None
+
+    def wait(self, count, timeout=None):
+        """
+        Wait until 'count' commands in total were processed,
+        returns True on success and False on timeout
+        """
+        with self._lock:
+            return self._lock.wait_for(lambda: self.processed >= count,
+                                       timeout)
+
+class SocketServer(object):
+    """
+    Unix socket server at 'path' applying commands to 'simulator',
+    each connection served in its own thread by 'handler', called with
+    the connected socket until the peer closes it
+    """
+
+    def __init__(self, simulator, path, handler):
+        self.simulator = simulator
+        self.path = path
+        self.handler = handler
+        self.connections = 0
+        self._sock = None
+        self._thread = None
+        self._conns = set()
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        self._sock.listen(16)
+        self._thread = threading.Thread(target=self._accept_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                # socket closed by stop()
+                return
+            self.connections += 1
+            self._conns.add(conn)
+            t = threading.Thread(target=self._serve_connection, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def _serve_connection(self, conn):
+        try:
+            self.handler(conn)
+        except OSError:
+            pass
+        finally:
+            self._conns.discard(conn)
+            conn.close()
+
+    def stop(self):
+        """
+        Stop server closing all connections, as Nagios does on restart
+        """
+        for conn in list(self._conns):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._sock is not None:
+            self._sock.shutdown(socket.SHUT_RDWR)
+            self._sock.close()
+            self._thread.join()
+            os.unlink(self.path)
+            self._sock = self._thread = None
+
+class QueryHandlerServer(SocketServer):
+    """
+    Nagios 4 query handler stand-in answering 'command run' queries:
+    '@' queries keep connection open, '#' queries close it after reply
+    """
+
+    def __init__(self, simulator, path):
+        SocketServer.__init__(self, simulator, path, self._serve)
+
+    def _serve(self, conn):
+        buf = b''
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                return
+            queries = (buf + data).split(b'\0')
+            buf = queries.pop()
+            replies = []
+            close = False
+            for query in queries:
+                keep, query = query[:1], query[1:]
+                if keep not in (b'@', b'#'):
+                    keep, query = b'#', keep + query
+                name, _, rest = query.partition(b' ')
+                action, _, line = rest.partition(b' ')
+                if name != b'command' or action != b'run':
+                    replies.append(b'404: Unknown query\0')
+                elif self.simulator.apply(line.decode('utf-8', 'replace')):
+                    replies.append(b'200: OK\0')
+                else:
+                    replies.append(b'400: Failed to run command\0')
+                if keep == b'#':
+                    close = True
+                    break
+            conn.sendall(b''.join(replies))
+            if close:
+                return
+
+class LivestatusServer(SocketServer):
+    """
+    Livestatus stand-in applying COMMAND requests (requests end with an
+    empty line), other requests are ignored
+    """
+
+    def __init__(self, simulator, path):
+        SocketServer.__init__(self, simulator, path, self._serve)
+
+    def _serve(self, conn):
+        buf = b''
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                return
+            requests = (buf + data).split(b'\n\n')
+            buf = requests.pop()
+            for request in requests:
+                line = request.lstrip(b'\n').partition(b'\n')[0]
+                if line.startswith(b'COMMAND '):
+                    self.simulator.apply(line[8:].decode('utf-8', 'replace'))
@@ -0,0 +1,366 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Cached Nagios state from status.dat.
+
+    status = StatusCache('/var/cache/nagios3/status.dat')
+    for svc in status.services(state=2, acknowledged=False):
+        ...
+    status.downtimes(host_name='web1')
+
+status.dat is read through mmap keeping only the fields below in
+__slots__ records, indexed by host, service and state. It is parsed again
+only when it changes, checked at most every 'check_interval' seconds.
+"""
+
+import mmap
+import os
+
+from time import time
+
+class StatusObject(object):
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, ' '.join(
+            '%s=%r' % (a, getattr(self, a, None)) for a in self.__slots__[:3]))
+
+class HostStatus(StatusObject):
+    __slots__ = ('host_name', 'current_state', 'state_type', 'plugin_output',
+                 'last_check', 'has_been_checked', 'acknowledged',
+                 'notifications_enabled', 'active_checks_enabled',
+                 'passive_checks_enabled', 'event_handler_enabled',
+                 'flap_detection_enabled', 'check_interval',
+                 'scheduled_downtime_depth', 'custom')
+    service_description = None
+
+class ServiceStatus(StatusObject):
+    __slots__ = ('host_name', 'service_description', 'current_state',
+                 'state_type', 'plugin_output', 'last_check',
+                 'has_been_checked', 'acknowledged', 'notifications_enabled',
+                 'active_checks_enabled', 'passive_checks_enabled',
+                 'event_handler_enabled', 'flap_detection_enabled',
+                 'check_interval', 'scheduled_downtime_depth', 'custom')
+
+class Downtime(StatusObject):
+    __slots__ = ('downtime_id', 'host_name', 'service_description',
+                 'entry_time', 'start_time', 'end_time', 'triggered_by',
+                 'fixed', 'duration', 'author', 'comment')
+
+class Comment(StatusObject):
+    __slots__ = ('comment_id', 'host_name', 'service_description',
+                 'entry_type', 'entry_time', 'persistent', 'author',
+                 'comment')
+
+def _bool(v):
+    return v == b'1'
+
+def _str(v):
+    return v.decode('utf-8', 'replace')
+
+# names repeat across blocks, decoded once per parse
+_NAME = None
+
+# status.dat field -> (attribute, conversion)
+_STATUS_FIELDS = {
+    b'host_name': ('host_name', _NAME),
+    b'service_description': ('service_description', _NAME),
+    b'current_state': ('current_state', int),
+    b'state_type': ('state_type', int),
+    b'plugin_output': ('plugin_output', _str),
+    b'last_check': ('last_check', int),
+    b'has_been_checked': ('has_been_checked', _bool),
+    b'problem_has_been_acknowledged': ('acknowledged', _bool),
+    b'notifications_enabled': ('notifications_enabled', _bool),
+    b'active_checks_enabled': ('active_checks_enabled', _bool),
+    b'passive_checks_enabled': ('passive_checks_enabled', _bool),
+    b'event_handler_enabled': ('event_handler_enabled', _bool),
+    b'flap_detection_enabled': ('flap_detection_enabled', _bool),
+    b'check_interval': ('check_interval', float),
+    b'scheduled_downtime_depth': ('scheduled_downtime_depth', int),
+}
+
+_DOWNTIME_FIELDS = {
+    b'host_name': ('host_name', _NAME),
+    b'service_description': ('service_description', _NAME),
+    b'downtime_id': ('downtime_id', int),
+    b'entry_time': ('entry_time', int),
+    b'start_time': ('start_time', int),
+    b'end_time': ('end_time', int),
+    b'triggered_by': ('triggered_by', int),
+    b'fixed': ('fixed', _bool),
+    b'duration': ('duration', int),
+    b'author': ('author', _str),
+    b'comment': ('comment', _str),
+}
+
+_COMMENT_FIELDS = {
+    b'host_name': ('host_name', _NAME),
+    b'service_description': ('service_description', _NAME),
+    b'comment_id': ('comment_id', int),
+    b'entry_type': ('entry_type', int),
+    b'entry_time': ('entry_time', int),
+    b'persistent': ('persistent', _bool),
+    b'author': ('author', _str),
+    b'comment_data': ('comment', _str),
+}
+
+# block name -> (record class, fields, keep custom variables)
+BLOCKS = {
+    b'hoststatus': (HostStatus, _STATUS_FIELDS, True),
+    b'servicestatus': (ServiceStatus, _STATUS_FIELDS, True),
+    b'hostdowntime': (Downtime, _DOWNTIME_FIELDS, False),
+    b'servicedowntime': (Downtime, _DOWNTIME_FIELDS, False),
+    b'hostcomment': (Comment, _COMMENT_FIELDS, False),
+    b'servicecomment': (Comment, _COMMENT_FIELDS, False),
+}
+
+def _custom(block):
+    """
+    Return {name: value} of custom variables '_NAME=modified;value'
+    """
+    custom = None
+    k = block.find(b'\n\t_')
+    while k >= 0:
+        e = block.find(b'\n', k + 3)
+        key, _, value = block[k + 3:e].partition(b'=')
+        if custom is None:
+            custom = {}
+        custom[_str(key)] = _str(value.partition(b';')[2])
+        k = block.find(b'\n\t_', e)
+    return custom
+
+def iter_status(path, blocks=BLOCKS):
+    """
+    Iterate over (block name, record) of status.dat 'path' for blocks
+    in 'blocks' dict {block name: (record class, fields, custom)}
+
+    Blocks are located with mmap.find and only wanted fields are looked
+    up in them, the other lines (most of a status block) are never split.
+    """
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return
+    try:
+        for item in _iter_blocks(mm, blocks):
+            yield item
+    finally:
+        mm.close()
+
+def _iter_blocks(buf, blocks):
+    """
+    Iterate over (block name, record) of status.dat contents 'buf'
+    (mmap or bytes)
+    """
+    specs = {}
+    for name, (cls, fields, custom) in blocks.items():
+        specs[name] = (cls, name.decode(), custom,
+                       [(b'\n\t' + key + b'=', attr, conv)
+                        for key, (attr, conv) in fields.items()
+                        if attr in cls.__slots__])
+    names = {}
+    find = buf.find
+    pos = 0
+    while True:
+        i = find(b' {\n', pos)
+        if i < 0:
+            break
+        j = find(b'\n\t}', i)
+        if j < 0:
+            break
+        spec = specs.get(buf[buf.rfind(b'\n', 0, i) + 1:i])
+        pos = j + 3
+        if spec is None:
+            continue
+        cls, name, custom, fields = spec
+        block = buf[i + 2:j + 1]
+        obj = cls.__new__(cls)
+        for key, attr, conv in fields:
+            k = block.find(key)
+            if k < 0:
+                value = None
+            else:
+                k += len(key)
+                value = block[k:block.index(b'\n', k)]
+                if conv is _NAME:
+                    s = names.get(value)
+                    if s is None:
+                        s = names[value] = _str(value)
+                    value = s
+                else:
+                    value = conv(value)
+            setattr(obj, attr, value)
+        if custom:
+            obj.custom = _custom(block)
+        yield name, obj
+
+def read_object(path, block, host_name, service_description=None):
+    """
+    Return record of one 'block' (like 'hoststatus') of 'host_name' and
+    'service_description' from status.dat 'path', or None if not found.
+
+    Blocks are searched for by their first line, host_name, without
+    parsing the rest of the file.
+    """
+    spec = BLOCKS[block.encode()]
+    head = b'%s {\n\thost_name=%s\n' % (block.encode(),
+                                          host_name.encode('utf-8'))
+    desc = None
+    if service_description is not None:
+        desc = b'\n\tservice_description=%s\n' % \
+            service_description.encode('utf-8')
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
+    try:
+        i = mm.find(head)
+        while i >= 0:
+            end = mm.find(b'\n\t}', i)
+            if end < 0:
+                return None
+            text = mm[i:end + 3]
+            if desc is None or desc in text:
+                blocks = {block.encode(): spec}
+                # parse just this block
+                for _, obj in _iter_blocks(text, blocks):
+                    return obj
+            i = mm.find(head, end)
+        return None
+    finally:
+        mm.close()
+
+class StatusCache(object):
+    """
+    Hosts, services, downtimes and comments of status.dat 'path'
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.hosts = {}
+        self.services_by_key = {}
+        self.downtimes_by_id = {}
+        self.comments_by_id = {}
+        self._by_host = {}
+        self._by_state = {}
+        self._stamp = None
+        self._checked = 0
+        self.refresh()
+
+    def refresh(self, force=False):
+        """
+        Parse status.dat again if it changed, returns True if parsed
+
+        Raises:
+          OSError: if status.dat can't be read
+        """
+        self._checked = time()
+        st = os.stat(self.path)
+        stamp = (st.st_ino, st.st_size, st.st_mtime)
+        if stamp == self._stamp and not force:
+            return False
+        hosts = {}
+        services = {}
+        by_host = {}
+        by_state = {}
+        downtimes = {}
+        comments = {}
+        for name, obj in iter_status(self.path):
+            if name == 'servicestatus':
+                services[(obj.host_name, obj.service_description)] = obj
+                by_host.setdefault(obj.host_name, []).append(obj)
+                by_state.setdefault(obj.current_state, []).append(obj)
+            elif name == 'hoststatus':
+                hosts[obj.host_name] = obj
+            elif name.endswith('downtime'):
+                downtimes[obj.downtime_id] = obj
+            else:
+                comments[obj.comment_id] = obj
+        self.hosts = hosts
+        self.services_by_key = services
+        self._by_host = by_host
+        self._by_state = by_state
+        self.downtimes_by_id = downtimes
+        self.comments_by_id = comments
+        self._stamp = stamp
+        return True
+
+    def maybe_refresh(self):
+        """
+        Refresh if 'check_interval' passed since last check
+        """
+        if time() - self._checked >= self.check_interval:
+            self.refresh()
+
+    def host(self, host_name):
+        self.maybe_refresh()
+        return self.hosts.get(host_name)
+
+    def service(self, host_name, service_description):
+        self.maybe_refresh()
+        return self.services_by_key.get((host_name, service_description))
+
+    def services(self, host_name=None, state=None, **attrs):
+        """
+        Return list of ServiceStatus of 'host_name' and in 'state' if given,
+        having other attributes equal to 'attrs'
+        """
+        self.maybe_refresh()
+        if host_name is not None:
+            found = self._by_host.get(host_name, [])
+            if state is not None:
+                found = [s for s in found if s.current_state == state]
+        elif state is not None:
+            found = self._by_state.get(state, [])
+        else:
+            found = self.services_by_key.values()
+        if attrs:
+            items = list(attrs.items())
+            found = [s for s in found
+                     if all(getattr(s, a) == v for a, v in items)]
+        return list(found)
+
+    def _select(self, objs, host_name, service_description, attrs):
+        items = list(attrs.items())
+        return [o for o in objs
+                if (host_name is None or o.host_name == host_name) and
+                (service_description is None or
+                 o.service_description == service_description) and
+                all(getattr(o, a) == v for a, v in items)]
+
+    def downtimes(self, host_name=None, service_description=None, **attrs):
+        """
+        Return list of Downtime filtered like services()
+        """
+        self.maybe_refresh()
+        return self._select(self.downtimes_by_id.values(), host_name,
+                            service_description, attrs)
+
+    def comments(self, host_name=None, service_description=None, **attrs):
+        """
+        Return list of Comment filtered like services()
+        """
+        self.maybe_refresh()
+        return self._select(self.comments_by_id.values(), host_name,
+                            service_description, attrs)
@@ -0,0 +1,168 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Vectorised evaluation of Nagios thresholds with NumPy (optional dependency).
+
+    states = submit(nagext, hosts, services, values, warning='80',
+                    critical='90', label='usage', uom='%')
+
+evaluates whole arrays of values against Nagios style ranges
+(see Nagios plugin development guidelines) and writes one passive check
+result per value in a single NagExt batch.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from nagext_perfdata import OK, WARNING, CRITICAL, UNKNOWN, STATE_NAMES
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError('nagext_thresholds requires numpy')
+
+class Range(object):
+    """
+    Nagios threshold range:
+    '10' (alert outside 0..10), '10:' (outside 10..inf), '~:10'
+    (outside -inf..10), '10:20' (outside 10..20), '@10:20' (inside 10..20)
+    """
+    __slots__ = ('spec', 'start', 'end', 'inside')
+
+    def __init__(self, spec):
+        self.spec = spec
+        spec = spec.strip()
+        self.inside = spec.startswith('@')
+        if self.inside:
+            spec = spec[1:]
+        if ':' in spec:
+            start, end = spec.split(':', 1)
+        else:
+            start, end = '0', spec
+        if start == '~':
+            self.start = float('-inf')
+        else:
+            self.start = float(start or 0)
+        self.end = float(end) if end else float('inf')
+        if self.start > self.end:
+            raise ValueError('Invalid range "%s": start > end' % self.spec)
+
+    def __repr__(self):
+        return '<Range %s>' % self.spec
+
+def _bounds(spec, n):
+    """
+    Return arrays (start, end, inside) for range spec: None, a string,
+    a Range or a sequence of them (one per value)
+    """
+    if spec is None:
+        return None
+    if isinstance(spec, (str, Range)):
+        r = spec if isinstance(spec, Range) else Range(spec)
+        return r.start, r.end, r.inside
+    ranges = [s if isinstance(s, Range) else Range(s) for s in spec]
+    if len(ranges) != n:
+        raise ValueError('%d ranges given for %d values' % (len(ranges), n))
+    return (numpy.array([r.start for r in ranges]),
+            numpy.array([r.end for r in ranges]),
+            numpy.array([r.inside for r in ranges]))
+
+def alerts(values, spec):
+    """
+    Return boolean array, True where 'values' raise alert for range 'spec'
+    """
+    _require_numpy()
+    values = numpy.asarray(values, dtype=float)
+    bounds = _bounds(spec, len(values))
+    if bounds is None:
+        return numpy.zeros(values.shape, dtype=bool)
+    start, end, inside = bounds
+    within = (values >= start) & (values <= end)
+    return numpy.where(inside, within, ~within)
+
+def evaluate(values, warning=None, critical=None):
+    """
+    Return array of states (OK, WARNING, CRITICAL, UNKNOWN for NaN)
+    of 'values' checked against 'warning' and 'critical' ranges
+    """
+    _require_numpy()
+    values = numpy.asarray(values, dtype=float)
+    states = numpy.full(values.shape, OK, dtype=numpy.int8)
+    states[alerts(values, warning)] = WARNING
+    states[alerts(values, critical)] = CRITICAL
+    states[numpy.isnan(values)] = UNKNOWN
+    return states
+
+def _spec_strings(spec, n):
+    if spec is None:
+        return [''] * n
+    if isinstance(spec, (str, Range)):
+        s = spec.spec if isinstance(spec, Range) else spec
+        return [s] * n
+    return [s.spec if isinstance(s, Range) else s for s in spec]
+
+def render(values, states, label='value', uom='', warning=None, critical=None,
+           minimum=None, maximum=None, fmt='%g'):
+    """
+    Return list of plugin outputs 'STATE - label=value|label=value;w;c;min;max'
+    """
+    values = numpy.asarray(values, dtype=float).tolist()
+    states = numpy.asarray(states).tolist()
+    n = len(values)
+    limits = ';%s;%s' % ('' if minimum is None else fmt % minimum,
+                         '' if maximum is None else fmt % maximum)
+    prefix = "'%s'" % label if (' ' in label or '=' in label) else label
+    out = []
+    for v, s, w, c in zip(values, states, _spec_strings(warning, n),
+                          _spec_strings(critical, n)):
+        v = 'U' if v != v else (fmt % v) + uom
+        out.append('%s - %s=%s|%s=%s;%s;%s%s' %
+                   (STATE_NAMES[s], label, v, prefix, v, w, c, limits))
+    return out
+
+def _broadcast(names, n):
+    if isinstance(names, str):
+        return [names] * n
+    names = list(names)
+    if len(names) != n:
+        raise ValueError('%d names given for %d values' % (len(names), n))
+    return names
+
+def submit(nagext, hosts, services, values, warning=None, critical=None,
+           label='value', uom='', minimum=None, maximum=None, fmt='%g'):
+    """
+    Evaluate 'values' and write one process_service_check_result per value
+    for corresponding host and service (a single name is used for all
+    values) in one NagExt batch. Returns array of states.
+    """
+    _require_numpy()
+    values = numpy.asarray(values, dtype=float)
+    n = len(values)
+    hosts = _broadcast(hosts, n)
+    services = _broadcast(services, n)
+    states = evaluate(values, warning, critical)
+    outputs = render(values, states, label, uom, warning, critical, minimum,
+                     maximum, fmt)
+    with nagext.batch():
+        run = nagext.process_service_check_result
+        for h, s, state, output in zip(hosts, services, states.tolist(),
+                                       outputs):
+            run(h, s, state, output)
+    return states
@@ -0,0 +1,326 @@
+# Copyright 2010 Alexander Duryagin
+#
+# This file is part of NagExt.
+#
+# NagExt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NagExt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NagExt.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Tracking of commands accepted by Nagios through nagios.log.
+
+    tracker = Tracker('/var/log/nagios3/nagios.log', timeout=60)
+    tracker.attach(nagext)
+    tracker.start()
+    ...
+    tracker.stats()    # command_id -> accepted count, latencies
+    tracker.missing    # commands not logged within 'timeout' seconds
+
+Commands run through NagExt are remembered by hash of their
+'command_id;arguments' text and matched with 'EXTERNAL COMMAND:' lines
+Nagios logs when log_external_commands is set. Passive check results are
+logged differently and are not tracked. nagios.log is followed with
+inotify (Linux, polled elsewhere), surviving log rotation.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import threading
+
+from collections import deque
+from time import time
+
+from nagext import format_args
+
+MARKER = b'EXTERNAL COMMAND: '
+
+# commands not logged as EXTERNAL COMMAND
+UNTRACKED = frozenset(['PROCESS_HOST_CHECK_RESULT',
+                       'PROCESS_SERVICE_CHECK_RESULT'])
+
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+def _inotify(directory):
+    """
+    Return inotify fd watching 'directory' for writes and new files,
+    or None if inotify is not available
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        init = libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    fd = init(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+    if fd < 0:
+        return None
+    wd = libc.inotify_add_watch(fd, os.fsencode(directory),
+                                IN_MODIFY | IN_MOVED_TO | IN_CREATE)
+    if wd < 0:
+        os.close(fd)
+        return None
+    return fd
+
+class CommandStats(object):
+    __slots__ = ('accepted', 'missing', 'total_latency', 'max_latency')
+
+    def __init__(self):
+        self.accepted = 0
+        self.missing = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def mean_latency(self):
+        return self.total_latency / self.accepted if self.accepted else 0.0
+
+    def as_dict(self):
+        return dict((name, getattr(self, name))
+                    for name in self.__slots__ + ('mean_latency',))
+
+class Tracker(object):
+    """
+    Matches commands sent through attached NagExt objects with nagios.log
+    'path'. Commands not seen within 'timeout' seconds are appended to
+    'missing' as (command line, time sent), keeping last 'max_missing'.
+    """
+
+    poll_interval = 1.0
+
+    def __init__(self, path, timeout=60.0, max_missing=10000):
+        self.path = path
+        self.timeout = timeout
+        self.missing = deque(maxlen=max_missing)
+        self.metrics = None
+        self._stats = {}
+        # hash of 'command_id;arguments' -> deque of times sent
+        self._pending = {}
+        # (time sent, hash, command line) in order sent, for expiry
+        self._order = deque()
+        self._outstanding = 0
+        self._lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+
+    def attach(self, nagext):
+        """
+        Track commands of 'nagext', using its metrics if any
+        """
+        if nagext.metrics is not None:
+            self.metrics = nagext.metrics
+        nagext.add_hook(pre=self._sending, post=self._sent)
+
+    def detach(self, nagext):
+        nagext.remove_hook(pre=self._sending, post=self._sent)
+
+    def _sending(self, cmd, args):
+        # remembered before writing, Nagios may log it before write returns
+        if cmd in UNTRACKED:
+            return None
+        line = '%s;%s' % (cmd, format_args(args))
+        key = hash(line)
+        started = time()
+        with self._lock:
+            sent = self._pending.get(key)
+            if sent is None:
+                sent = self._pending[key] = deque()
+            sent.append(started)
+            self._order.append((started, key, line))
+            self._outstanding += 1
+        return key, started
+
+    def _sent(self, cmd, args, started, elapsed, error, context):
+        if error is None or context is None:
+            return
+        # not written, forget it
+        key, started = context
+        with self._lock:
+            sent = self._pending.get(key)
+            if sent and started in sent:
+                sent.remove(started)
+                if not sent:
+                    del self._pending[key]
+                self._outstanding -= 1
+
+    def pending(self):
+        """
+        Return number of commands not seen in nagios.log yet
+        """
+        return self._outstanding
+
+    def _stat(self, cmd):
+        s = self._stats.get(cmd)
+        if s is None:
+            s = self._stats[cmd] = CommandStats()
+        return s
+
+    def accept(self, line, now=None):
+        """
+        Match 'command_id;arguments' 'line' logged by Nagios,
+        returns latency in seconds or None if the command is not tracked
+        """
+        if now is None:
+            now = time()
+        key = hash(line)
+        with self._lock:
+            sent = self._pending.get(key)
+            if not sent:
+                return None
+            started = sent.popleft()
+            if not sent:
+                del self._pending[key]
+            self._outstanding -= 1
+            latency = now - started
+            s = self._stat(line.partition(';')[0])
+            s.accepted += 1
+            s.total_latency += latency
+            s.max_latency = max(s.max_latency, latency)
+        if self.metrics is not None:
+            self.metrics.inc('commands_accepted')
+            self.metrics.observe('acceptance_latency', latency)
+        return latency
+
+    def expire(self, now=None):
+        """
+        Move commands sent more than 'timeout' seconds ago to 'missing',
+        returns number of them
+        """
+        if now is None:
+            now = time()
+        deadline = now - self.timeout
+        expired = 0
+        with self._lock:
+            order = self._order
+            while order and order[0][0] < deadline:
+                started, key, line = order.popleft()
+                sent = self._pending.get(key)
+                # accepted commands are removed from _pending only,
+                # oldest first, so the entry is still there if not seen
+                if not sent or sent[0] != started:
+                    continue
+                sent.popleft()
+                if not sent:
+                    del self._pending[key]
+                self._outstanding -= 1
+                self.missing.append((line, started))
+                self._stat(line.partition(';')[0]).missing += 1
+                expired += 1
+        if expired and self.metrics is not None:
+            self.metrics.inc('commands_missing', expired)
+        return expired
+
+    def stats(self):
+        """
+        Return dict command_id -> CommandStats.as_dict()
+        """
+        with self._lock:
+            return dict((cmd, s.as_dict()) for cmd, s in self._stats.items())
+
+    def feed(self, data):
+        """
+        Process complete nagios.log lines 'data' (bytes)
+        """
+        now = time()
+        start = data.find(MARKER)
+        while start >= 0:
+            start += len(MARKER)
+            end = data.find(b'\n', start)
+            if end < 0:
+                end = len(data)
+            self.accept(data[start:end].rstrip(b'\r').decode(
+                'utf-8', 'replace'), now)
+            start = data.find(MARKER, end)
+
+    def start(self):
+        """
+        Start following nagios.log from its current end in a thread
+        """
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._follow)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _read(self, f, buf):
+        """
+        Feed complete lines appended to 'f', return incomplete rest
+        """
+        data = f.read()
+        if not data:
+            return buf
+        data = buf + data
+        end = data.rfind(b'\n') + 1
+        self.feed(data[:end])
+        return data[end:]
+
+    def _wait(self, ifd):
+        """
+        Wait for changes in log directory, at most 'poll_interval'
+        """
+        if ifd is None:
+            self._stop.wait(self.poll_interval)
+        elif select.select([ifd], [], [], self.poll_interval)[0]:
+            try:
+                while os.read(ifd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def _follow(self):
+        ifd = _inotify(os.path.dirname(os.path.abspath(self.path)))
+        f = None
+        ino = None
+        buf = b''
+        # only new entries are of interest, but all of a rotated log
+        from_start = False
+        try:
+            while not self._stop.is_set():
+                if f is None:
+                    try:
+                        f = open(self.path, 'rb')
+                    except (IOError, OSError):
+                        from_start = True
+                        self._wait(ifd)
+                        continue
+                    ino = os.fstat(f.fileno()).st_ino
+                    if not from_start:
+                        f.seek(0, os.SEEK_END)
+                    buf = b''
+                buf = self._read(f, buf)
+                try:
+                    st = os.stat(self.path)
+                    rotated = st.st_ino != ino or st.st_size < f.tell()
+                except OSError:
+                    rotated = True
+                if rotated:
+                    # lines written to the old file before rotation
+                    self._read(f, buf)
+                    f.close()
+                    f = None
+                    from_start = True
+                    continue
+                self.expire()
+                self._wait(ifd)
+        finally:
+            if f is not None:
+                f.close()
+            if ifd is not None:
+                os.close(ifd)
@@ -10,5 +10,11 @@ setup(name='python-nagext',
     author='Alexander Duryagin',
     author_email='daa@vologda.ru',
     url='http://github.com/daa/nagext',
-    py_modules=['nagext'])
+    py_modules=['nagext', 'nagext_replay',
+        'nagext_sim', 'nagext_metrics', 'nagext_ring', 'nagext_executor',
+        'nagext_thresholds', 'nagext_perfdata', 'nagext_objects',
+        'nagext_status', 'nagext_bulk', 'nagext_planner',
+        'nagext_reconcile', 'nagext_downtime', 'nagext_qh',
+        'nagext_livestatus', 'nagext_tracker', 'nagext_probe',
+        'nagext_restart', 'nagext_scheduler'])
 
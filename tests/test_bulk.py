@@ -0,0 +1,187 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nagext import NagExt
+from nagext_bulk import (delete_comments, delete_downtimes, find_comments,
+                         find_downtimes)
+from nagext_sim import Simulator
+
+STATUS = '''info {
+\tcreated=1700000000
+\t}
+
+hoststatus {
+\thost_name=web1
+\tcurrent_state=0
+\t}
+
+hostdowntime {
+\thost_name=web1
+\tdowntime_id=1
+\tentry_time=1000
+\tstart_time=2000
+\tend_time=3000
+\ttriggered_by=0
+\tfixed=1
+\tduration=1000
+\tauthor=deploy
+\tcomment=Release
+\t}
+
+servicedowntime {
+\thost_name=web1
+\tservice_description=HTTP
+\tdowntime_id=2
+\tentry_time=1000
+\tstart_time=2000
+\tend_time=3000
+\ttriggered_by=0
+\tfixed=1
+\tduration=1000
+\tauthor=deploy
+\tcomment=Release
+\t}
+
+servicedowntime {
+\thost_name=db1
+\tservice_description=MySQL
+\tdowntime_id=3
+\tentry_time=1000
+\tstart_time=5000
+\tend_time=6000
+\ttriggered_by=0
+\tfixed=1
+\tduration=1000
+\tauthor=admin
+\tcomment=Maintenance
+\t}
+
+hostdowntime {
+\thost_name=db1
+\tdowntime_id=4
+\tentry_time=1000
+\tstart_time=5000
+\tend_time=6000
+\ttriggered_by=0
+\tfixed=1
+\tduration=1000
+\tauthor=admin
+\tcomment=Maintenance
+\t}
+
+hostcomment {
+\thost_name=web1
+\tcomment_id=1
+\tentry_type=1
+\tentry_time=1500
+\tpersistent=1
+\tauthor=deploy
+\tcomment_data=Deploying release
+\t}
+
+servicecomment {
+\thost_name=web1
+\tservice_description=HTTP
+\tcomment_id=2
+\tentry_type=1
+\tentry_time=2500
+\tpersistent=1
+\tauthor=admin
+\tcomment_data=Flaky
+\t}
+
+hostcomment {
+\thost_name=db1
+\tcomment_id=3
+\tentry_type=1
+\tentry_time=4000
+\tpersistent=0
+\tauthor=admin
+\tcomment_data=Replaced disk
+\t}
+'''
+
+class BulkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.status = os.path.join(self.dir, 'status.dat')
+        with open(self.status, 'w') as f:
+            f.write(STATUS)
+        self.command_file = os.path.join(self.dir, 'nagios.cmd')
+        os.mkfifo(self.command_file)
+        self.simulator = Simulator()
+        state = self.simulator.state
+        # same ids as in status.dat
+        for host, service, start, author in (
+                ('web1', None, 2000, 'deploy'),
+                ('web1', 'HTTP', 2000, 'deploy'),
+                ('db1', 'MySQL', 5000, 'admin'),
+                ('db1', None, 5000, 'admin')):
+            state.add_downtime(host, service, (start, start + 1000, 1, 0,
+                                               1000, author, 'x'))
+        for host, service, author in (('web1', None, 'deploy'),
+                                      ('web1', 'HTTP', 'admin'),
+                                      ('db1', None, 'admin')):
+            state.add_comment(host, service, 1, author, 'x')
+        self.simulator.start(self.command_file)
+        self.nagext = NagExt(self.command_file)
+        self.sent = []
+        self.nagext.add_hook(pre=lambda cmd, args: self.sent.append(
+            '%s;%s' % (cmd, args[0])))
+
+    def tearDown(self):
+        self.nagext.close()
+        self.simulator.stop()
+        shutil.rmtree(self.dir)
+
+    def wait(self):
+        self.assertTrue(self.simulator.wait(len(self.sent), 5))
+
+    def test_delete_downtimes_by_host(self):
+        found = delete_downtimes(self.nagext, self.status, host='web*')
+        self.assertEqual([d.downtime_id for d in found], [1, 2])
+        self.assertEqual(self.sent, ['DEL_HOST_DOWNTIME;1',
+                                     'DEL_SVC_DOWNTIME;2'])
+        self.wait()
+        self.assertEqual(sorted(self.simulator.state.downtimes), [3, 4])
+
+    def test_delete_host_downtimes_by_author(self):
+        delete_downtimes(self.nagext, self.status, author='admin',
+                         service='')
+        self.assertEqual(self.sent, ['DEL_HOST_DOWNTIME;4'])
+
+    def test_delete_downtimes_by_time(self):
+        delete_downtimes(self.nagext, self.status, start=4000)
+        self.assertEqual(self.sent, ['DEL_SVC_DOWNTIME;3',
+                                     'DEL_HOST_DOWNTIME;4'])
+        self.assertEqual(
+            [d.downtime_id for d in find_downtimes(self.status, end=3000)],
+            [1, 2])
+
+    def test_delete_comments(self):
+        delete_comments(self.nagext, self.status, service='HTTP')
+        delete_comments(self.nagext, self.status, comment='disk')
+        self.assertEqual(self.sent, ['DEL_SVC_COMMENT;2',
+                                     'DEL_HOST_COMMENT;3'])
+        self.wait()
+        self.assertEqual(sorted(self.simulator.state.comments), [1])
+        self.assertEqual(
+            [c.comment_id for c in find_comments(self.status, end=2000)],
+            [1])
+
+    def test_criteria_required(self):
+        with self.assertRaises(ValueError):
+            delete_downtimes(self.nagext, self.status)
+        with self.assertRaises(ValueError):
+            delete_comments(self.nagext, self.status, host=None)
+        self.assertEqual(self.sent, [])
+        found = delete_downtimes(self.nagext, self.status, all=True)
+        self.assertEqual(len(found), 4)
+        self.wait()
+        self.assertEqual(self.simulator.state.downtimes, {})
+
+if __name__ == '__main__':
+    unittest.main()
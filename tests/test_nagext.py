@@ -0,0 +1,125 @@
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import unittest
+
+from nagext import NagExt
+from nagext_metrics import Metrics
+from nagext_sim import Simulator
+
+class FifoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.command_file = os.path.join(self.dir, 'nagios.cmd')
+        os.mkfifo(self.command_file)
+        self.simulator = Simulator()
+        self.simulator.start(self.command_file)
+
+    def tearDown(self):
+        self.simulator.stop()
+        shutil.rmtree(self.dir)
+
+    def hosts_checked(self):
+        return sorted(name for name, host in
+                      self.simulator.state.hosts.items()
+                      if not host.active_checks_enabled)
+
+class BatchTest(FifoTestCase):
+
+    def test_dropped_on_exception(self):
+        nagext = NagExt(self.command_file)
+        with nagext.batch():
+            nagext.disable_host_check('a')
+            try:
+                with nagext.batch():
+                    nagext.disable_host_check('b')
+                    raise KeyError
+            except KeyError:
+                pass
+            nagext.disable_host_check('c')
+        with self.assertRaises(KeyError):
+            with nagext.batch():
+                nagext.disable_host_check('d')
+                raise KeyError
+        nagext.disable_host_check('e')
+        nagext.close()
+        self.assertTrue(self.simulator.wait(3, 5))
+        self.assertEqual(self.hosts_checked(), ['a', 'c', 'e'])
+
+    def test_other_threads(self):
+        nagext = NagExt(self.command_file, adaptive=True)
+        started = threading.Event()
+        done = threading.Event()
+
+        def other():
+            started.wait()
+            nagext.disable_host_check('other')
+            nagext.flush()
+            done.set()
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        with self.assertRaises(KeyError):
+            with nagext.batch():
+                nagext.disable_host_check('batched')
+                started.set()
+                done.wait(5)
+                raise KeyError
+        thread.join()
+        nagext.close()
+        self.assertTrue(self.simulator.wait(1, 5))
+        self.assertEqual(self.hosts_checked(), ['other'])
+
+    def test_metrics_count_written(self):
+        metrics = Metrics()
+        nagext = NagExt(self.command_file, metrics=metrics)
+        nagext.enable_host_check('a')
+        with nagext.batch():
+            nagext.enable_host_check('b')
+            nagext.disable_host_check('b')
+        with self.assertRaises(KeyError):
+            with nagext.batch():
+                nagext.disable_host_check('c')
+                raise KeyError
+        nagext.close()
+        self.assertEqual(metrics.commands, {'ENABLE_HOST_CHECK': 2,
+                                            'DISABLE_HOST_CHECK': 1})
+
+class ForkTest(FifoTestCase):
+
+    def test_fork_inside_batch(self):
+        nagext = NagExt(self.command_file)
+        pid = None
+        try:
+            with nagext.batch():
+                nagext.disable_host_check('parent1')
+                pid = os.fork()
+                nagext.disable_host_check('parent2' if pid else 'child')
+        finally:
+            if pid == 0:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        nagext.close()
+        self.assertTrue(self.simulator.wait(3, 5))
+        self.assertEqual(self.hosts_checked(),
+                         ['child', 'parent1', 'parent2'])
+        self.assertEqual(self.simulator.processed, 3)
+
+    def test_pickle(self):
+        metrics = Metrics()
+        nagext = NagExt(self.command_file, metrics=metrics, adaptive=True)
+        nagext.add_hook(pre=lambda cmd, args: None)
+        copy = pickle.loads(pickle.dumps(nagext))
+        nagext.close()
+        self.assertIsNone(copy.metrics)
+        self.assertTrue(copy.adaptive)
+        copy.disable_host_check('copy')
+        copy.close()
+        self.assertTrue(self.simulator.wait(1, 5))
+        self.assertEqual(self.hosts_checked(), ['copy'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from nagext import format_args
+from nagext_perfdata import (DEFAULT_MAX_LENGTH, MAX_EXTERNAL_COMMAND_LENGTH,
+                             PluginOutput, max_output_length)
+
+class PluginOutputTest(unittest.TestCase):
+
+    def render(self, text, max_length, long_output=()):
+        out = PluginOutput(text, max_length)
+        for line in long_output:
+            out.add_long(line)
+        return out.render_bytes()
+
+    def test_escape(self):
+        self.assertEqual(self.render('a\\b|c\r\nd', 100), b'a\\\\b/c\\nd')
+
+    def test_cut_on_utf8_boundary(self):
+        text = 'x' + 'é' * 10 + '€' * 10
+        for limit in range(len(text.encode('utf-8')) + 1):
+            data = self.render(text, limit)
+            self.assertLessEqual(len(data), limit)
+            # decodes without a cut character
+            self.assertTrue(text.startswith(data.decode('utf-8')))
+
+    def test_cut_on_escape(self):
+        for limit in range(12):
+            data = self.render('ab\\\\\n\\cd', limit)
+            self.assertLessEqual(len(data), limit)
+            stripped = data.rstrip(b'\\')
+            self.assertEqual((len(data) - len(stripped)) % 2, 0)
+
+    def test_long_output_dropped_first(self):
+        out = PluginOutput('OK', 20)
+        out.add_perf('time', 1.5, 's')
+        out.add_long('x' * 100)
+        self.assertEqual(out.render_bytes()[:13], b'OK|time=1.5s\\')
+        self.assertLessEqual(len(out.render_bytes()), 20)
+        out = PluginOutput('OK - ' + 'y' * 100, 30)
+        out.add_perf('time', 1.5, 's')
+        data = out.render_bytes()
+        self.assertEqual(len(data), 30)
+        self.assertTrue(data.endswith(b'|time=1.5s'))
+
+    def test_command_line_fits(self):
+        for host, service in (('web1', 'HTTP'), ('h' * 255, 's' * 255),
+                              ('höst', None)):
+            limit = max_output_length(host, service)
+            if service is None:
+                cmd, names = 'PROCESS_HOST_CHECK_RESULT', (host,)
+            else:
+                cmd, names = 'PROCESS_SERVICE_CHECK_RESULT', (host, service)
+            output = PluginOutput('x' * 10000, limit).render()
+            line = ('[%d] %s;%s\n' % (
+                1792424000, cmd, format_args(names + (2, output)))
+                ).encode('utf-8')
+            # fgets() of Nagios keeps room for NUL
+            self.assertEqual(len(line), MAX_EXTERNAL_COMMAND_LENGTH - 1)
+        self.assertEqual(DEFAULT_MAX_LENGTH,
+                         max_output_length('h' * 255, 's' * 255))
+
+if __name__ == '__main__':
+    unittest.main()
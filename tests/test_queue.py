@@ -0,0 +1,89 @@
+import random
+import unittest
+
+from nagext import (NAME_ARGS, CommandQueue, NameTable, commands,
+                    format_args)
+
+NAMES = ['web1', 'db;primary', 'höst', b'bytes-host', 'x' * 300, '']
+OTHER = [0, 1, True, False, 3.5, 'text', 'semi;colon', b'raw bytes',
+         'café', '']
+
+def line(timestamp, cmd, args):
+    return ('[%lu] %s;%s\n' % (timestamp, cmd, format_args(args))
+            ).encode('utf-8')
+
+class CommandQueueTest(unittest.TestCase):
+
+    def generate(self, rnd, count):
+        table = sorted(commands().items())
+        out = []
+        for i in range(count):
+            cmd, names = rnd.choice(table)
+            n = len(names)
+            if i % 17 == 0:
+                # wrong number of arguments
+                n = max(n + rnd.choice((-1, 1)), 0)
+            args = tuple(rnd.choice(NAMES) if names[k:k + 1] and
+                         names[k] in NAME_ARGS else rnd.choice(OTHER)
+                         for k in range(n))
+            out.append((1700000000 + i // 7, cmd, args))
+        out.append((1700000001, 'NOT_GENERATED', ('a', 1)))
+        return out
+
+    def check(self, queue, items):
+        queue.clear()
+        for item in items:
+            queue.append(*item)
+        self.assertEqual(len(queue), len(items))
+        self.assertEqual(queue.encode(),
+                         b''.join(line(*item) for item in items))
+
+    def test_encode_all_commands(self):
+        rnd = random.Random(1)
+        items = self.generate(rnd, 3000)
+        self.assertEqual(set(cmd for _, cmd, _ in items) - {'NOT_GENERATED'},
+                         set(commands()))
+        self.check(CommandQueue(), items)
+
+    def test_full_name_table(self):
+        rnd = random.Random(2)
+        self.check(CommandQueue(NameTable(3)), self.generate(rnd, 1000))
+
+    def test_truncate(self):
+        rnd = random.Random(3)
+        items = self.generate(rnd, 500)
+        for count in (0, 1, 250, 499, len(items), len(items) + 5):
+            queue = CommandQueue(NameTable(50))
+            for item in items:
+                queue.append(*item)
+            queue.truncate(count)
+            self.assertEqual(queue.encode(),
+                             b''.join(line(*item) for item in items[:count]))
+            # appends after truncate go to the right place
+            queue.append(*items[0])
+            self.assertEqual(queue.encode(),
+                             b''.join(line(*item) for item in
+                                      items[:count] + [items[0]]))
+
+    def test_counts(self):
+        queue = CommandQueue()
+        queue.append(1, 'ENABLE_HOST_CHECK', ('a',))
+        queue.append(1, 'ENABLE_HOST_CHECK', ('a', 'extra'))
+        queue.append(1, 'DISABLE_HOST_CHECK', ('b',))
+        self.assertEqual(queue.counts(), {'ENABLE_HOST_CHECK': 2,
+                                          'DISABLE_HOST_CHECK': 1})
+
+    def test_names_dropped_with_queue(self):
+        queue = CommandQueue()
+        queue.append(1, 'ENABLE_HOST_CHECK', ('a',))
+        self.assertEqual(len(queue.names), 1)
+        queue.clear()
+        self.assertEqual(len(queue.names), 0)
+        table = NameTable()
+        queue = CommandQueue(table)
+        queue.append(1, 'ENABLE_HOST_CHECK', ('a',))
+        queue.clear()
+        self.assertEqual(len(table), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from nagext import NagExt
+from nagext_replay import Journal, RecordingNagExt, replay
+from nagext_sim import Simulator
+
+class RecordingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.command_file = os.path.join(self.dir, 'nagios.cmd')
+        os.mkfifo(self.command_file)
+        # keeps the fifo open without a reader thread in forked children
+        self.reader = os.open(self.command_file, os.O_RDWR)
+        self.journal = os.path.join(self.dir, 'journal.gz')
+
+    def tearDown(self):
+        os.close(self.reader)
+        shutil.rmtree(self.dir)
+
+    def read(self, path):
+        return [(cmd, args) for _, cmd, args in Journal(path)]
+
+    def fork(self, child):
+        pid = os.fork()
+        if not pid:
+            try:
+                child()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        return pid
+
+    def test_forked_children(self):
+        nagext = RecordingNagExt(self.command_file, self.journal)
+        nagext.disable_host_check('parent1')
+
+        def recording():
+            nagext.disable_host_check('child')
+            nagext.close()
+
+        silent = self.fork(lambda: None)
+        recorded = self.fork(recording)
+        nagext.disable_host_check('parent2')
+        nagext.close()
+        self.assertEqual(self.read(self.journal),
+                         [('DISABLE_HOST_CHECK', 'parent1'),
+                          ('DISABLE_HOST_CHECK', 'parent2')])
+        self.assertFalse(os.path.exists('%s.%d' % (self.journal, silent)))
+        self.assertEqual(self.read('%s.%d' % (self.journal, recorded)),
+                         [('DISABLE_HOST_CHECK', 'child')])
+
+    def test_not_picklable(self):
+        nagext = RecordingNagExt(self.command_file, self.journal)
+        with self.assertRaises(TypeError):
+            pickle.dumps(nagext)
+        nagext.close()
+
+    def test_replay(self):
+        nagext = RecordingNagExt(self.command_file, self.journal)
+        for host in ('a', 'b', 'c'):
+            nagext.disable_host_check(host)
+        nagext.close()
+        os.close(self.reader)
+        simulator = Simulator()
+        simulator.start(self.command_file)
+        self.reader = os.open(self.command_file, os.O_RDWR)
+        try:
+            target = NagExt(self.command_file)
+            stats = replay(self.journal, target, speed=0)
+            target.close()
+            self.assertEqual(stats.count, 3)
+            self.assertTrue(simulator.wait(3, 5))
+        finally:
+            simulator.stop()
+        self.assertEqual(sorted(simulator.state.hosts), ['a', 'b', 'c'])
+
+if __name__ == '__main__':
+    unittest.main()
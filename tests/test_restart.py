@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from nagext import NagExt
+from nagext_restart import CommandsHeld, RestartGate
+from nagext_sim import Simulator
+
+class RecordingSimulator(Simulator):
+
+    def __init__(self):
+        Simulator.__init__(self)
+        self.lines = []
+
+    def apply(self, line):
+        self.lines.append(line.partition('] ')[2].rstrip('\n'))
+        return Simulator.apply(self, line)
+
+class RestartGateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.command_file = os.path.join(self.dir, 'nagios.cmd')
+        os.mkfifo(self.command_file)
+        self.lock_file = os.path.join(self.dir, 'nagios.lock')
+        with open(self.lock_file, 'w') as f:
+            f.write('%d\n' % os.getpid())
+        self.simulator = RecordingSimulator()
+        self.gate = RestartGate(self.command_file, lock_file=self.lock_file,
+                                settle=30)
+        self.gate.poll_interval = 0.02
+
+    def tearDown(self):
+        self.simulator.stop()
+        shutil.rmtree(self.dir)
+
+    def wait_until(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_restart(self):
+        self.simulator.start(self.command_file)
+        nagext = NagExt(None, transport=self.gate)
+        nagext.disable_host_check('a')
+        nagext.restart_program()
+        self.assertTrue(self.gate.paused)
+        nagext.disable_host_check('b')
+        self.assertTrue(self.simulator.wait(2, 5))
+        # Nagios exits and comes back
+        self.simulator.stop()
+        nagext.disable_host_check('c')
+        time.sleep(0.1)
+        self.assertTrue(self.gate.paused)
+        self.assertTrue(self.gate.buffered)
+        self.simulator.start(self.command_file)
+        self.wait_until(lambda: not self.gate.buffered)
+        nagext.disable_host_check('d')
+        nagext.close()
+        self.assertTrue(self.simulator.wait(5, 5))
+        self.assertEqual(self.simulator.lines, [
+            'DISABLE_HOST_CHECK;a', 'RESTART_PROGRAM;',
+            'DISABLE_HOST_CHECK;b', 'DISABLE_HOST_CHECK;c',
+            'DISABLE_HOST_CHECK;d'])
+        self.assertEqual(self.gate.pauses, 1)
+
+    def test_no_reader(self):
+        nagext = NagExt(None, transport=self.gate)
+        for host in ('a', 'b'):
+            nagext.disable_host_check(host)
+        self.assertTrue(self.gate.paused)
+        self.simulator.start(self.command_file)
+        nagext.close()
+        self.assertTrue(self.simulator.wait(2, 5))
+        self.assertEqual(self.simulator.lines, ['DISABLE_HOST_CHECK;a',
+                                                'DISABLE_HOST_CHECK;b'])
+
+    def test_close_while_held(self):
+        nagext = NagExt(None, transport=self.gate)
+        nagext.disable_host_check('a')
+        started = time.time()
+        with self.assertRaises(CommandsHeld):
+            self.gate.close(0.2)
+        self.assertLess(time.time() - started, 2)
+        # kept for the next open
+        self.assertTrue(self.gate.buffered)
+        self.simulator.start(self.command_file)
+        self.gate.open()
+        self.gate.close()
+        self.assertTrue(self.simulator.wait(1, 5))
+        self.assertEqual(self.simulator.lines, ['DISABLE_HOST_CHECK;a'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from nagext_ring import CommandRing, RingFull, RingNagExt, RingWriter
+from nagext_sim import Simulator
+
+def produce(ring, name, count):
+    nagext = RingNagExt(ring, timeout=10)
+    with nagext.batch():
+        for i in range(count):
+            nagext.disable_host_check('%s-%d' % (name, i))
+
+class CommandRingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = CommandRing(100)
+
+    def tearDown(self):
+        self.ring.close()
+        self.ring.unlink()
+
+    def test_wraparound(self):
+        sent = []
+        received = []
+        for i in range(50):
+            data = b'[1] CMD;%d;%s\n' % (i, b'x' * (i % 30))
+            self.ring.put(data, 0)
+            sent.append(data)
+            # leave some bytes behind so positions move around the ring
+            received.append(self.ring.get(len(data) - i % 3))
+        received.append(self.ring.get(100))
+        self.assertEqual(b''.join(received), b''.join(sent))
+        self.assertEqual(len(self.ring), 0)
+
+    def test_full(self):
+        self.ring.put(b'x' * 60 + b'\n', 0)
+        with self.assertRaises(RingFull):
+            self.ring.put(b'y' * 60 + b'\n', 0.05)
+        with self.assertRaises(RingFull):
+            self.ring.put(b'z' * 150 + b'\n', 0)
+
+    def test_oversized_put(self):
+        data = b''.join(b'[1] CMD;%d;%s\n' % (i, b'x' * (i % 40))
+                        for i in range(200))
+        received = []
+
+        def consume():
+            size = 0
+            while size < len(data):
+                chunk = self.ring.get(64)
+                received.append(chunk)
+                size += len(chunk)
+                if not chunk:
+                    self.ring.wait(0.01)
+
+        thread = threading.Thread(target=consume)
+        thread.start()
+        self.ring.put(data, 5)
+        thread.join()
+        self.assertEqual(b''.join(received), data)
+
+class RingWriterTest(unittest.TestCase):
+
+    def test_producers(self):
+        tmp = tempfile.mkdtemp()
+        command_file = os.path.join(tmp, 'nagios.cmd')
+        os.mkfifo(command_file)
+        simulator = Simulator()
+        simulator.start(command_file)
+        # smaller than a batch of a producer
+        ring = CommandRing(4096)
+        writer = RingWriter(ring, command_file)
+        writer.start()
+        try:
+            producers = [multiprocessing.Process(target=produce,
+                                                 args=(ring, 'p%d' % n, 500))
+                         for n in range(3)]
+            for p in producers:
+                p.start()
+            for p in producers:
+                p.join()
+            writer.stop()
+            self.assertTrue(simulator.wait(1500, 10))
+        finally:
+            simulator.stop()
+            ring.close()
+            ring.unlink()
+            shutil.rmtree(tmp)
+        self.assertEqual(simulator.errors, [])
+        self.assertEqual(simulator.ignored, 0)
+        self.assertEqual(len(simulator.state.hosts), 1500)
+
+if __name__ == '__main__':
+    unittest.main()
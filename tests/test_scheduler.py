@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from nagext import ExecError, NagExt
+from nagext_objects import ValidationError
+from nagext_qh import QueryHandlerTransport
+from nagext_scheduler import Scheduler
+from nagext_sim import QueryHandlerServer, Simulator
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.simulator = Simulator()
+        self.server = QueryHandlerServer(self.simulator,
+                                         os.path.join(self.dir, 'qh.sock'))
+        self.server.start()
+        self.transport = QueryHandlerTransport(self.server.path)
+        self.nagext = NagExt(None, transport=self.transport)
+        self.scheduler = Scheduler(self.nagext,
+                                   os.path.join(self.dir, 'deferred.db'),
+                                   batch_size=10)
+
+    def tearDown(self):
+        self.scheduler.close()
+        self.nagext.close()
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def schedule(self, hosts, due=1):
+        for host in hosts:
+            self.scheduler.schedule(due, 'disable_host_check', host)
+
+    def hosts_checked(self):
+        return sorted(name for name, host in
+                      self.simulator.state.hosts.items()
+                      if not host.active_checks_enabled)
+
+    def test_batches(self):
+        hosts = ['h%02d' % i for i in range(25)]
+        self.schedule(hosts)
+        self.schedule(['later'], due=time.time() + 3600)
+        self.assertEqual(self.scheduler.fire(), 25)
+        self.assertEqual(self.hosts_checked(), hosts)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.scheduler), 1)
+
+    def test_validation_error(self):
+        def pre(cmd, args):
+            if args[0] == 'bad':
+                raise ValidationError('Unknown host bad')
+        self.nagext.add_hook(pre=pre)
+        self.schedule(['a', 'bad', 'b'])
+        self.assertEqual(self.scheduler.fire(), 2)
+        self.assertEqual(self.hosts_checked(), ['a', 'b'])
+        self.assertEqual(len(self.scheduler), 0)
+        failures = self.scheduler.failures()
+        self.assertEqual([f[3] for f in failures], [('bad',)])
+        self.assertEqual(failures[0][5], 'Unknown host bad')
+
+    def test_rejected_by_nagios(self):
+        self.schedule(['a'])
+        self.scheduler.schedule(1, 'change_contact_host_notification_'
+                                'timeperiod', 'admin', '24x7')
+        self.schedule(['b'])
+        self.assertEqual(self.scheduler.fire(), 2)
+        self.assertEqual(self.transport.accepted, 2)
+        self.assertEqual(self.hosts_checked(), ['a', 'b'])
+        failures = self.scheduler.failures()
+        self.assertEqual([f[2] for f in failures],
+                         ['CHANGE_CONTACT_HOST_NOTIFICATION_TIMEPERIOD'])
+
+    def test_write_error(self):
+        self.schedule(['a', 'b'])
+        self.server.stop()
+        with self.assertRaises(ExecError):
+            self.scheduler.fire()
+        self.assertEqual(len(self.scheduler), 2)
+        self.server.start()
+        self.assertEqual(self.scheduler.fire(), 2)
+
+    def test_thread_survives_errors(self):
+        calls = []
+        def pre(cmd, args):
+            calls.append(cmd)
+            if len(calls) == 1:
+                raise TypeError('broken hook')
+        self.nagext.add_hook(pre=pre)
+        self.scheduler.retry_interval = 0.05
+        self.schedule(['a'])
+        self.scheduler.start()
+        try:
+            deadline = time.time() + 5
+            while len(self.scheduler) and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            self.scheduler.stop()
+        self.assertEqual(self.hosts_checked(), ['a'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nagext import NagExt
+from nagext_sim import Simulator
+
+class FifoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.command_file = os.path.join(self.dir, 'nagios.cmd')
+        os.mkfifo(self.command_file)
+        self.simulator = Simulator()
+        self.simulator.start(self.command_file)
+
+    def tearDown(self):
+        self.simulator.stop()
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        nagext = NagExt(self.command_file)
+        try:
+            nagext.disable_svc_notifications('web1', 'HTTP')
+            with nagext.batch():
+                for i in range(1000):
+                    nagext.disable_host_check('h%d' % i)
+        finally:
+            nagext.close()
+        self.assertTrue(self.simulator.wait(1001, 5))
+        hosts = self.simulator.state.hosts
+        self.assertFalse(
+            hosts['web1'].services['HTTP'].notifications_enabled)
+        self.assertFalse(hosts['h999'].active_checks_enabled)
+        self.assertEqual(self.simulator.errors, [])
+
+    def test_malformed_lines(self):
+        fd = os.open(self.command_file, os.O_WRONLY)
+        try:
+            os.write(fd, b'[1] SCHEDULE_HOST_DOWNTIME;web1;x\n'
+                         b'[1] DISABLE_HOST_CHECK;web1\n')
+        finally:
+            os.close(fd)
+        self.assertTrue(self.simulator.wait(2, 5))
+        self.assertEqual(len(self.simulator.errors), 1)
+        self.assertFalse(
+            self.simulator.state.hosts['web1'].active_checks_enabled)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nagext import NagExt
+from nagext_livestatus import LivestatusTransport
+from nagext_qh import CommandRejected, QueryHandlerTransport
+from nagext_sim import LivestatusServer, QueryHandlerServer, Simulator
+
+class SocketTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.simulator = Simulator()
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+        shutil.rmtree(self.dir)
+
+    def start(self, cls, name):
+        server = cls(self.simulator, os.path.join(self.dir, name))
+        server.start()
+        self.servers.append(server)
+        return server
+
+class QueryHandlerTest(SocketTestCase):
+
+    def setUp(self):
+        SocketTestCase.setUp(self)
+        self.server = self.start(QueryHandlerServer, 'qh.sock')
+        self.transport = QueryHandlerTransport(self.server.path)
+        self.nagext = NagExt(None, transport=self.transport)
+
+    def tearDown(self):
+        self.nagext.close()
+        SocketTestCase.tearDown(self)
+
+    def test_pipelined_batch(self):
+        with self.nagext.batch():
+            for i in range(5000):
+                self.nagext.disable_host_check('h%d' % i)
+        self.assertEqual(self.transport.accepted, 5000)
+        self.assertEqual(self.simulator.processed, 5000)
+        self.assertFalse(
+            self.simulator.state.hosts['h4999'].active_checks_enabled)
+
+    def test_rejected(self):
+        with self.assertRaises(CommandRejected) as cm:
+            with self.nagext.batch():
+                self.nagext.enable_host_check('web1')
+                self.nagext.run('NO_SUCH_COMMAND', 1)
+                self.nagext.enable_host_check('web2')
+        replies = cm.exception.replies
+        self.assertEqual(len(replies), 1)
+        self.assertIn('NO_SUCH_COMMAND;1', replies[0][0])
+        self.assertEqual(self.transport.accepted, 2)
+        self.assertEqual(self.transport.rejected, 1)
+
+    def test_reconnect_after_restart(self):
+        self.nagext.enable_host_check('web1')
+        self.server.stop()
+        self.servers.remove(self.server)
+        self.server = self.start(QueryHandlerServer, 'qh.sock')
+        self.nagext.enable_host_check('web2')
+        self.assertEqual(self.simulator.processed, 2)
+        self.assertEqual(self.server.connections, 1)
+
+class LivestatusTest(SocketTestCase):
+
+    def test_failover(self):
+        first = self.start(LivestatusServer, 'ls1.sock')
+        second = self.start(LivestatusServer, 'ls2.sock')
+        transport = LivestatusTransport([first.path, second.path])
+        nagext = NagExt(None, transport=transport)
+        try:
+            nagext.enable_host_check('web1')
+            self.assertTrue(self.simulator.wait(1, 5))
+            self.assertEqual(second.connections, 0)
+            first.stop()
+            self.servers.remove(first)
+            nagext.enable_host_check('web2')
+            self.assertTrue(self.simulator.wait(2, 5))
+            self.assertEqual(transport.failovers, 1)
+            self.assertEqual(second.connections, 1)
+        finally:
+            nagext.close()
+
+if __name__ == '__main__':
+    unittest.main()